@@ -341,18 +341,18 @@ class Model():
             X, y, self.batch_size, shuffle_start)
         print('Started training...')
         for epoch in range(0, num_epochs):
-            epoch_start = time.clock()
+            epoch_start = time.perf_counter()
             if shuffle_each:
                 X_batches, y_batches = self.make_batches(X, y, self.batch_size)
             total_loss = 0
             for X_batch, y_batch, batch_num in zip(
                     X_batches, y_batches, range(0, self.num_batches)):
-                batch_start = time.clock()
                 loss = self.update_step(X_batch, y_batch)
                 total_loss += loss
 
-                batch_time = time.clock() - batch_start
-                time_rem = self.etr(batch_time, batch_num, self.num_batches)
+                mean_time = (time.perf_counter() - epoch_start) / \
+                    (batch_num + 1)
+                time_rem = self.etr(mean_time, batch_num, self.num_batches)
                 self.write_progress(epoch, num_epochs, batch_num,
                                     time_rem, loss)
 
@@ -367,7 +367,7 @@ class Model():
             if save_ind is None:
                 self.save_params(params_filename)
 
-            epoch_time = time.clock() - epoch_start
+            epoch_time = time.perf_counter() - epoch_start
             avg_loss = total_loss / self.num_batches
             self.write_progress(epoch, num_epochs, self.num_batches - 1,
                                 epoch_time, avg_loss)
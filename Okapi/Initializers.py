@@ -71,7 +71,7 @@ class MultiInit(Initializer):
         best_params = model.init_params
         X_batches, y_batches = model.make_batches(X, y)
         for iteration in range(self.num_iterations):
-            start_time = time.clock()
+            start_time = time.perf_counter()
             params = model.get_simple_init_params(model.param_dims)
             model.update_shared_params(params)
             loss = 0
@@ -81,7 +81,7 @@ class MultiInit(Initializer):
             if loss < best_loss:
                 best_params = params
                 best_loss = loss
-            total_time = time.clock() - start_time
+            total_time = time.perf_counter() - start_time
             time_remaining = total_time * (self.num_iterations - iteration - 1)
             sys.stdout.write(
                 "\rIteration: {}/{} | ETR: {}s | Best Initial Loss: {}    "
@@ -1,10 +1,13 @@
-import theano.tensor as T
+from OkapiV2.Backend import T
 
 
 class Accuracy():
     def __init__(self):
         return
 
+    def get_config(self):
+        return {}
+
     def get_hyperparams_shape(self, max_layer_size, input_shape):
         return None
 
@@ -17,3 +20,25 @@ class Categorical(Accuracy):
         return T.mean(T.eq(
             T.argmax(y.flatten(2), axis=1),
             T.argmax(y_hat.flatten(2), axis=1)))
+
+
+class TopK(Accuracy):
+    def __init__(self, k=5):
+        self.k = k
+
+    def get_config(self):
+        return {'k': self.k}
+
+    def get_accuracy(self, y_hat, y):
+        top_k = T.argsort(y_hat.flatten(2), axis=1)[:, -self.k:]
+        labels = T.argmax(y.flatten(2), axis=1)
+        return T.mean(T.any(T.eq(top_k, labels.dimshuffle(0, 'x')), axis=1))
+
+
+def confusion_matrix(y_hat, y):
+    '''Rows are true classes, columns are predicted classes.'''
+    y_hat = y_hat.flatten(2)
+    preds = T.argmax(y_hat, axis=1)
+    preds_onehot = T.set_subtensor(
+        T.zeros_like(y_hat)[T.arange(preds.shape[0]), preds], 1)
+    return T.dot(y.flatten(2).T, preds_onehot)
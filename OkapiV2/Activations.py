@@ -1,4 +1,4 @@
-import theano.tensor as T
+from OkapiV2.Backend import T
 
 
 def softmax(input):
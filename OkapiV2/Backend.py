@@ -0,0 +1,44 @@
+'''Lazily imported backends.
+
+Theano and its submodules are only imported on first attribute access, so
+importing OkapiV2 modules that merely define layers, losses or optimizers
+costs no more than NumPy until a graph is actually built.
+'''
+import importlib
+
+
+class LazyModule():
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def load(self):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return self.module
+
+    def __getattr__(self, attr):
+        if attr in ('name', 'module'):
+            raise AttributeError(attr)
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.module is not None else 'not loaded'
+        return '<lazy module {} ({})>'.format(self.name, state)
+
+
+theano = LazyModule('theano')
+T = LazyModule('theano.tensor')
+rng_mrg = LazyModule('theano.sandbox.rng_mrg')
+downsample = LazyModule('theano.tensor.signal.downsample')
+dnn = LazyModule('theano.sandbox.cuda.dnn')
+
+
+def dnn_available():
+    '''Whether cuDNN can be used. False when the old CUDA backend cannot
+    be imported at all, e.g. on CPU-only installs.
+    '''
+    try:
+        return dnn.dnn_available()
+    except ImportError:
+        return False
@@ -0,0 +1,271 @@
+import multiprocessing
+import traceback
+import sys
+import time
+
+
+class Callback():
+    '''Base class for hooks called by Model.train.
+
+    With every_n_batches or every_seconds set, on_batch_end only fires every
+    n batches or once the given number of seconds has passed since it last
+    fired, whichever comes first; otherwise it fires after every batch. The
+    model is available as self.model and training can be stopped by setting
+    self.model.stop_training.
+    '''
+    def __init__(self, every_n_batches=None, every_seconds=None):
+        self.every_n_batches = every_n_batches
+        self.every_seconds = every_seconds
+        self.model = None
+
+    def set_model(self, model):
+        self.model = model
+
+    def reset_throttle(self):
+        self.batches_since = 0
+        self.last_fired = time.perf_counter()
+
+    def should_fire(self):
+        if self.every_n_batches is None and self.every_seconds is None:
+            return True
+        self.batches_since += 1
+        if self.every_n_batches is not None and \
+                self.batches_since >= self.every_n_batches:
+            self.reset_throttle()
+            return True
+        if self.every_seconds is not None:
+            now = time.perf_counter()
+            if now - self.last_fired >= self.every_seconds:
+                self.batches_since = 0
+                self.last_fired = now
+                return True
+        return False
+
+    def on_train_begin(self, logs):
+        pass
+
+    def on_epoch_begin(self, epoch, logs):
+        pass
+
+    def on_batch_end(self, epoch, batch_num, logs):
+        pass
+
+    def on_epoch_end(self, epoch, logs):
+        pass
+
+    def on_train_end(self, logs):
+        pass
+
+
+class CallbackList():
+    '''Dispatches Model.train events to a list of callbacks.'''
+    def __init__(self, callbacks, model):
+        self.callbacks = list(callbacks)
+        for callback in self.callbacks:
+            callback.set_model(model)
+
+    def on_train_begin(self, logs):
+        for callback in self.callbacks:
+            callback.on_train_begin(logs)
+
+    def on_epoch_begin(self, epoch, logs):
+        for callback in self.callbacks:
+            callback.reset_throttle()
+            callback.on_epoch_begin(epoch, logs)
+
+    def on_batch_end(self, epoch, batch_num, logs):
+        for callback in self.callbacks:
+            if callback.should_fire():
+                callback.on_batch_end(epoch, batch_num, logs)
+
+    def on_epoch_end(self, epoch, logs):
+        for callback in self.callbacks:
+            callback.on_epoch_end(epoch, logs)
+
+    def on_train_end(self, logs):
+        for callback in self.callbacks:
+            callback.on_train_end(logs)
+
+
+def get_callback_list(callbacks, model, verbose=True):
+    '''Returns the CallbackList of a training run. With verbose a
+    ProgressReporter is added first unless one is already given.
+    '''
+    callbacks = list(callbacks) if callbacks is not None else []
+    if verbose and not any(isinstance(callback, ProgressReporter)
+                           for callback in callbacks):
+        callbacks.insert(0, ProgressReporter())
+    return CallbackList(callbacks, model)
+
+
+class LambdaCallback(Callback):
+    '''Wraps plain functions, like the batch_callback and epoch_callback of
+    the original Okapi trainer. Each function receives the same arguments
+    as the hook it replaces.
+    '''
+    def __init__(self, on_batch_end=None, on_epoch_end=None,
+                 every_n_batches=None, every_seconds=None):
+        super().__init__(every_n_batches, every_seconds)
+        self.batch_function = on_batch_end
+        self.epoch_function = on_epoch_end
+
+    def on_batch_end(self, epoch, batch_num, logs):
+        if self.batch_function is not None:
+            self.batch_function(epoch, batch_num, logs)
+
+    def on_epoch_end(self, epoch, logs):
+        if self.epoch_function is not None:
+            self.epoch_function(epoch, logs)
+
+
+class ProgressReporter(Callback):
+    '''Rewrites the progress line at most once every every_seconds.
+
+    The default of 0.1s keeps writing progress far below 0.1% of the step
+    time however small the batches are. The full line for the epoch is
+    always written at its end.
+    '''
+    def __init__(self, every_seconds=0.1):
+        super().__init__(every_seconds=every_seconds)
+
+    def on_batch_end(self, epoch, batch_num, logs):
+        telemetry = logs['telemetry']
+        time_rem = self.model.est_time_remaining(
+            telemetry.mean_batch_time(), batch_num, logs['num_batches'])
+        self.model.write_progress(epoch, logs['num_epochs'],
+                                  batch_num, logs['num_batches'],
+                                  time_rem, logs['loss'], logs['metrics'])
+        sys.stdout.flush()
+
+    def on_epoch_end(self, epoch, logs):
+        self.model.write_progress(epoch, logs['num_epochs'],
+                                  logs['num_batches'] - 1,
+                                  logs['num_batches'],
+                                  logs['stats'].wall_time,
+                                  logs['stats'].loss, logs['metrics'])
+        print()
+
+
+class ParamsSaver(Callback):
+    '''Saves the params with Model.save_params every every_n_batches
+    batches, or at the end of every epoch by default.
+    '''
+    def __init__(self, filename='okapi_params.pk', every_n_batches=None,
+                 every_seconds=None):
+        super().__init__(every_n_batches, every_seconds)
+        self.filename = filename
+        self.per_batch = every_n_batches is not None or \
+            every_seconds is not None
+
+    def on_batch_end(self, epoch, batch_num, logs):
+        if self.per_batch:
+            self.model.save_params(self.filename)
+
+    def on_epoch_end(self, epoch, logs):
+        if not self.per_batch:
+            self.model.save_params(self.filename)
+
+
+class EarlyStopping(Callback):
+    '''Validates parameter snapshots in a background process and stops
+    training once monitor has not improved for patience epochs.
+
+    At the end of every epoch the params are copied with get_params_as_vec
+    into a shared buffer and handed to a forked worker, which evaluates
+    them on x_val and y_val with its own compiled evaluate function while
+    training carries on. A result is collected when it arrives, at the
+    latest at the end of the next epoch, so stopping lags by at most one
+    epoch. With restore_best the params of the best epoch are restored
+    when training ends. self.history holds (epoch, results) pairs.
+    '''
+    def __init__(self, x_val, y_val, patience=3, monitor='loss',
+                 min_delta=0., restore_best=True, batch_size=1024,
+                 verbose=True):
+        super().__init__()
+        self.x_val = x_val
+        self.y_val = y_val
+        self.patience = patience
+        self.monitor = monitor
+        self.min_delta = min_delta
+        self.restore_best = restore_best
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.maximize = 'accuracy' in monitor
+        self.worker = None
+
+    def on_train_begin(self, logs):
+        from OkapiV2.Parallel import shared_array
+        params = self.model.get_params_as_vec()
+        self.params = shared_array(params.shape)
+        self.history = []
+        self.best = None
+        self.best_epoch = None
+        self.best_params = None
+        self.wait = 0
+        self.pending = None
+        context = multiprocessing.get_context('fork')
+        self.conn, worker_conn = context.Pipe()
+        self.worker = context.Process(target=self.work, args=(worker_conn,))
+        self.worker.daemon = True
+        self.worker.start()
+
+    def work(self, conn):
+        while True:
+            epoch = conn.recv()
+            if epoch is None:
+                return
+            try:
+                self.model.set_params_as_vec(self.params)
+                results = self.model.evaluate(self.x_val[:], self.y_val,
+                                              self.batch_size)
+            except Exception:
+                traceback.print_exc()
+                results = None
+            conn.send((epoch, results))
+
+    def collect(self, block):
+        if self.pending is None or not (block or self.conn.poll()):
+            return
+        epoch, results = self.conn.recv()
+        snapshot = self.pending
+        self.pending = None
+        if results is None:
+            raise Exception('Validation of epoch {} failed'
+                            .format(epoch + 1))
+        self.history.append((epoch, results))
+        value = results[self.monitor]
+        if self.best is None:
+            improved = True
+        elif self.maximize:
+            improved = value > self.best + self.min_delta
+        else:
+            improved = value < self.best - self.min_delta
+        if improved:
+            self.best = value
+            self.best_epoch = epoch
+            self.best_params = snapshot
+            self.wait = 0
+        else:
+            self.wait += 1
+            if self.wait >= self.patience:
+                self.model.stop_training = True
+        if self.verbose:
+            print('Validation after epoch {} | {}: {}{}'
+                  .format(epoch + 1, self.monitor, round(value, 6),
+                          ' | best' if improved else ''))
+
+    def on_epoch_end(self, epoch, logs):
+        self.collect(block=True)
+        if self.model.stop_training:
+            return
+        self.pending = self.model.get_params_as_vec().astype('float32')
+        self.params[:] = self.pending
+        self.conn.send(epoch)
+
+    def on_train_end(self, logs):
+        self.collect(block=True)
+        self.conn.send(None)
+        self.worker.join()
+        self.worker = None
+        if self.restore_best and self.best_params is not None:
+            self.model.set_params_as_vec(self.best_params)
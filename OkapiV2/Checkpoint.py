@@ -0,0 +1,195 @@
+from OkapiV2.Callbacks import Callback
+import numpy as np
+import collections
+import os
+import queue
+import re
+import threading
+
+
+def sync_dir(dirname):
+    '''Syncs a directory so that a rename in it survives a crash, where
+    directories can be opened.'''
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(dirname, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class CheckpointWriter():
+    '''Writes the params and optimizer accumulators to .npz checkpoints on
+    a background thread.
+
+    save only copies the arrays into preallocated host buffers, so
+    training pauses for a memcpy while the writer thread casts them (to
+    float16 with half=True), writes them to a temporary file and renames
+    it into place with os.replace once it is synced to disk. Two buffer
+    sets let one checkpoint be written while the next is taken. Numbering
+    continues after the checkpoints already in dirname, and only the last
+    keep checkpoints are kept on disk.
+    '''
+    def __init__(self, model, dirname='checkpoints', keep=3, half=False,
+                 compress=False, num_buffers=2):
+        self.model = model
+        self.dirname = dirname
+        self.keep = keep
+        self.half = half
+        self.compress = compress
+        self.num_buffers = num_buffers
+        self.free_buffers = None
+        self.written = collections.deque()
+        self.count = 0
+        self.error = None
+
+    def get_shared(self):
+        shared = [('param_{}'.format(i), params)
+                  for i, params in enumerate(self.model.get_all_params())]
+        accumulators = getattr(self.model.optimizer, 'accumulators', [])
+        shared += [('accumulator_{}'.format(i), accumulator)
+                   for i, accumulator in enumerate(accumulators)]
+        return shared
+
+    def find_existing(self):
+        '''Returns the numbers and paths of the checkpoints in dirname.'''
+        existing = []
+        for name in os.listdir(self.dirname):
+            match = re.match(r'checkpoint_(\d+)\.npz$', name)
+            if match:
+                existing.append((int(match.group(1)),
+                                 os.path.join(self.dirname, name)))
+        return sorted(existing)
+
+    def start(self):
+        os.makedirs(self.dirname, exist_ok=True)
+        for number, filename in self.find_existing():
+            if filename not in self.written:
+                self.written.append(filename)
+            self.count = max(self.count, number + 1)
+        self.shared = self.get_shared()
+        self.free_buffers = queue.Queue()
+        for i in range(self.num_buffers):
+            buffers = [np.empty_like(shared.get_value(borrow=True))
+                       for name, shared in self.shared]
+            self.free_buffers.put(buffers)
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self.write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, epoch=0, batch_num=0):
+        '''Snapshots the model and queues the snapshot to be written.'''
+        if self.error is not None:
+            raise self.error
+        if self.free_buffers is None:
+            self.start()
+        buffers = self.free_buffers.get()
+        for buffer, (name, shared) in zip(buffers, self.shared):
+            np.copyto(buffer, shared.get_value(borrow=True))
+        filename = os.path.join(self.dirname,
+                                'checkpoint_{:06d}.npz'.format(self.count))
+        self.count += 1
+        self.jobs.put((filename, buffers, epoch, batch_num))
+        return filename
+
+    def write_loop(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            filename, buffers, epoch, batch_num = job
+            try:
+                self.write(filename, buffers, epoch, batch_num)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.free_buffers.put(buffers)
+                self.jobs.task_done()
+
+    def write(self, filename, buffers, epoch, batch_num):
+        arrays = {'epoch': np.array(epoch), 'batch_num': np.array(batch_num)}
+        for buffer, (name, shared) in zip(buffers, self.shared):
+            if self.half:
+                buffer = buffer.astype('float16')
+            arrays[name] = buffer
+        tmp_filename = filename + '.tmp'
+        try:
+            with open(tmp_filename, 'wb') as file:
+                if self.compress:
+                    np.savez_compressed(file, **arrays)
+                else:
+                    np.savez(file, **arrays)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        sync_dir(self.dirname)
+        self.written.append(filename)
+        while len(self.written) > self.keep:
+            os.remove(self.written.popleft())
+
+    def wait(self):
+        '''Blocks until every queued checkpoint has been written.'''
+        if self.free_buffers is not None:
+            self.jobs.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.free_buffers is not None:
+            self.jobs.put(None)
+            self.thread.join()
+            self.free_buffers = None
+        if self.error is not None:
+            raise self.error
+
+    def latest(self):
+        return self.written[-1] if self.written else None
+
+
+def load_checkpoint(model, filename):
+    '''Restores the params and optimizer accumulators saved by a
+    CheckpointWriter and returns the (epoch, batch_num) they were saved at.
+    '''
+    with np.load(filename) as arrays:
+        for i, params in enumerate(model.get_all_params()):
+            params.set_value(arrays['param_{}'.format(i)].astype('float32'))
+        accumulators = getattr(model.optimizer, 'accumulators', [])
+        for i, accumulator in enumerate(accumulators):
+            name = 'accumulator_{}'.format(i)
+            if name in arrays:
+                accumulator.set_value(arrays[name].astype('float32'))
+        return int(arrays['epoch']), int(arrays['batch_num'])
+
+
+class Checkpointer(Callback):
+    '''Checkpoints through a CheckpointWriter at the end of every epoch, or
+    every every_n_batches batches or every_seconds seconds if given.
+    '''
+    def __init__(self, dirname='checkpoints', keep=3, half=False,
+                 compress=False, every_n_batches=None, every_seconds=None):
+        super().__init__(every_n_batches, every_seconds)
+        self.writer_args = (dirname, keep, half, compress)
+        self.per_batch = every_n_batches is not None or \
+            every_seconds is not None
+        self.writer = None
+
+    def on_train_begin(self, logs):
+        self.writer = CheckpointWriter(self.model, *self.writer_args)
+
+    def on_batch_end(self, epoch, batch_num, logs):
+        if self.per_batch:
+            self.writer.save(epoch, batch_num)
+
+    def on_epoch_end(self, epoch, logs):
+        if not self.per_batch:
+            self.writer.save(epoch, logs['num_batches'] - 1)
+
+    def on_train_end(self, logs):
+        self.writer.close()
@@ -1,18 +1,28 @@
 from OkapiV2 import Losses, Accuracies, Optimizers, Initializers
-import theano
-import theano.tensor as T
+from OkapiV2 import Telemetry, Callbacks
+from OkapiV2.Backend import theano, T
 import numpy as np
-import sklearn as sk
 import sys
 import pickle
 import time
+import queue
+import threading
+import itertools
 
 
-def atleast_4d(x):
+def expand_4d(x):
     if x.ndim < 4:
-        return np.expand_dims(np.atleast_3d(x), axis=3).astype('float32')
+        return np.expand_dims(np.atleast_3d(x), axis=3)
     else:
-        return x.astype('float32')
+        return x
+
+
+def atleast_4d(x):
+    return expand_4d(x).astype('float32', copy=False)
+
+
+def cast_updates(updates):
+    return [(shared, update.astype('float32')) for shared, update in updates]
 
 
 def save_model(model, filename='okapi_model.pk'):
@@ -37,9 +47,9 @@ def make_batches(x, y, batch_size=128, shuffle=True, nest=True):
     if y.shape[0] % batch_size is not 0:
         num_batches += 1
     if shuffle:
-        shuffled_arrays = sk.utils.shuffle(*x, y)
-        x = shuffled_arrays[:len(x)]
-        y = shuffled_arrays[-1]
+        permutation = np.random.permutation(y.shape[0])
+        x = [x_input[permutation] for x_input in x]
+        y = y[permutation]
     x_batches_list = []
     for i in range(len(x)):
         x_batches_list.append(np.array_split(x[i], num_batches))
@@ -56,6 +66,174 @@ def make_batches(x, y, batch_size=128, shuffle=True, nest=True):
     return x_batches, y_batches, num_batches
 
 
+class BatchIterator():
+    '''Iterates over minibatches without copying the inputs.
+
+    Only an index permutation is shuffled. Batches are gathered and cast to
+    float32 one at a time into preallocated buffers which are reused in
+    turn, so a batch is only valid until num_buffers more batches have been
+    requested. Unshuffled float32 batches are plain slices of the inputs.
+
+    Inputs may be memmaps (e.g. np.load(filename, mmap_mode='r')). With
+    chunk_size set, shuffling permutes the order of contiguous chunks and
+    the examples within each chunk, and each batch is read in ascending
+    order, so random access stays local in the page cache. It defaults to
+    64 batches when any input is a memmap.
+    '''
+    def __init__(self, x, y, batch_size=128, shuffle=True, num_buffers=1,
+                 chunk_size=None):
+        self.x = [expand_4d(x_input) for x_input in x]
+        self.y = expand_4d(y)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.num_examples = self.y.shape[0]
+        self.num_batches = -(-self.num_examples // batch_size)
+        self.indices = np.arange(self.num_examples, dtype='int32')
+        if chunk_size is None and any(isinstance(array, np.memmap)
+                                      for array in self.x + [self.y]):
+            chunk_size = batch_size * 64
+        self.chunk_size = chunk_size
+        self.buffers = []
+        needs_cast = any(array.dtype != np.float32
+                         for array in self.x + [self.y])
+        if shuffle or needs_cast:
+            for i in range(num_buffers):
+                x_buffers = [np.empty((batch_size,) + x_input.shape[1:],
+                                      dtype='float32')
+                             for x_input in self.x]
+                y_buffer = np.empty((batch_size,) + self.y.shape[1:],
+                                    dtype='float32')
+                self.buffers.append((x_buffers, y_buffer))
+        self.buffer_index = 0
+
+    def __len__(self):
+        return self.num_batches
+
+    def shuffle_indices(self):
+        if self.chunk_size is None:
+            np.random.shuffle(self.indices)
+            return
+        num_chunks = -(-self.num_examples // self.chunk_size)
+        start = 0
+        for chunk in np.random.permutation(num_chunks):
+            chunk_start = chunk * self.chunk_size
+            chunk_stop = min(chunk_start + self.chunk_size,
+                             self.num_examples)
+            chunk_indices = self.indices[start:start + chunk_stop -
+                                         chunk_start]
+            chunk_indices[:] = np.arange(chunk_start, chunk_stop)
+            np.random.shuffle(chunk_indices)
+            start += chunk_stop - chunk_start
+        for batch_num in range(self.num_batches):
+            self.get_batch_indices(batch_num).sort()
+
+    def gather(self, array, start, stop, buffer):
+        size = stop - start
+        if not self.shuffle:
+            if array.dtype == np.float32:
+                return array[start:stop]
+            buffer[:size] = array[start:stop]
+            return buffer[:size]
+        indices = self.indices[start:stop]
+        if array.dtype == np.float32:
+            return np.take(array, indices, axis=0, out=buffer[:size],
+                           mode='clip')
+        buffer[:size] = array[indices]
+        return buffer[:size]
+
+    def get_batch(self, batch_num):
+        start = batch_num * self.batch_size
+        stop = min(start + self.batch_size, self.num_examples)
+        if self.buffers:
+            x_buffers, y_buffer = self.buffers[self.buffer_index]
+            self.buffer_index = (self.buffer_index + 1) % len(self.buffers)
+        else:
+            x_buffers, y_buffer = [None] * len(self.x), None
+        x_batch = []
+        for x_input, x_buffer in zip(self.x, x_buffers):
+            x_batch.append(self.gather(x_input, start, stop, x_buffer))
+        y_batch = self.gather(self.y, start, stop, y_buffer)
+        return x_batch, y_batch
+
+    def get_batch_indices(self, batch_num):
+        start = batch_num * self.batch_size
+        return self.indices[start:start + self.batch_size]
+
+    def iter_indices(self):
+        if self.shuffle:
+            self.shuffle_indices()
+        for batch_num in range(self.num_batches):
+            yield self.get_batch_indices(batch_num)
+
+    def __iter__(self):
+        if self.shuffle:
+            self.shuffle_indices()
+        for batch_num in range(self.num_batches):
+            yield self.get_batch(batch_num)
+
+
+class Prefetcher():
+    '''Prepares the batches of an iterable on a background thread.
+
+    Up to depth batches are kept ready in a bounded queue while the caller
+    works on the current one. A BatchIterator wrapped by a Prefetcher needs
+    at least depth + 2 buffers.
+    '''
+    def __init__(self, batches, depth=2):
+        self.batches = batches
+        self.depth = depth
+
+    def __len__(self):
+        return len(self.batches)
+
+    def put(self, batch_queue, stop_event, item):
+        while not stop_event.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(self, batch_queue, stop_event):
+        try:
+            for batch in self.batches:
+                if not self.put(batch_queue, stop_event, (batch, None)):
+                    return
+            self.put(batch_queue, stop_event, (None, None))
+        except Exception as e:
+            self.put(batch_queue, stop_event, (None, e))
+
+    def __iter__(self):
+        batch_queue = queue.Queue(maxsize=self.depth)
+        stop_event = threading.Event()
+        producer = threading.Thread(target=self.produce,
+                                    args=(batch_queue, stop_event))
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                batch, error = batch_queue.get()
+                if error is not None:
+                    raise error
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            stop_event.set()
+            producer.join()
+
+
+def get_batches(x, y, batch_size=128, shuffle=True, prefetch=0,
+                chunk_size=None):
+    if prefetch:
+        batches = BatchIterator(x, y, batch_size, shuffle,
+                                num_buffers=prefetch + 2,
+                                chunk_size=chunk_size)
+        return Prefetcher(batches, prefetch)
+    return BatchIterator(x, y, batch_size, shuffle, chunk_size=chunk_size)
+
+
 class Branch():
     def __init__(self):
         self.inputs = []
@@ -87,7 +265,7 @@ class Branch():
 
     def get_output_dim(self):
         shapes = []
-        if len(self.inputs) > 1 and self.merge_mode is 'flat_append':
+        if len(self.inputs) > 1 and self.merge_mode == 'flat_append':
             for input in self.inputs:
                 if isinstance(input, np.ndarray):
                     shapes.append(input.shape[1:])
@@ -99,7 +277,7 @@ class Branch():
                     prod *= dim
                 shapes[i] = prod
             self.input_shape = (1, sum(shapes), 1, 1)
-        elif len(self.inputs) is 1:
+        elif len(self.inputs) == 1:
             self.input_shape = self.inputs[0].shape
         else:
             raise Exception('Invalid merge type')
@@ -125,12 +303,20 @@ class Branch():
         return num_data_inputs
 
     def get_output(self, params_list, data_tensors, testing=False):
+        x, layer_outputs, updates = self.get_layer_outputs(
+            params_list, data_tensors, testing)
+        if layer_outputs:
+            x = layer_outputs[-1]
+        output = x.astype('float32')
+        return output, updates
+
+    def get_layer_outputs(self, params_list, data_tensors, testing=False):
+        '''Returns the merged input, the output of every layer and the
+        layer updates.
+        '''
         branch_params = params_list[0]
         param_i = 1
         updates = []
-        for layer in self.layers:
-            if layer.updates is not None:
-                updates += layer.updates
         inputs = self.inputs[:]
         for i in range(len(inputs)):
             if isinstance(inputs[i], np.ndarray):
@@ -139,19 +325,65 @@ class Branch():
                 inputs[i], us = inputs[i].get_output(params_list[param_i:], data_tensors, testing)
                 param_i += 1
                 updates += us
-            if self.merge_mode is 'flat_append' and len(inputs) > 1:
+            if self.merge_mode == 'flat_append' and len(inputs) > 1:
                 inputs[i] = inputs[i].flatten(2)
-            elif self.merge_mode is not 'flat_append':
+            elif self.merge_mode != 'flat_append':
                 raise Exception('Invalid merge mode')
-        if len(inputs) > 1 and self.merge_mode is 'flat_append':
+        if len(inputs) > 1 and self.merge_mode == 'flat_append':
             x = T.concatenate(inputs, axis=1)
         else:
             x = inputs[0]
         current_layer = x
+        layer_outputs = []
         for layer, params in zip(self.layers, branch_params):
             current_layer = layer.get_output(current_layer, params, testing)
-        output = current_layer.astype('float32')
-        return output, updates
+            layer_outputs.append(current_layer)
+            # Layers such as BatchNorm only set their updates in get_output.
+            if layer.updates is not None:
+                updates += layer.updates
+        return x, layer_outputs, updates
+
+    def get_population_output(self, params_list, data_tensors,
+                              population_size, testing=True):
+        '''Like get_output for a population of parameter sets at once.
+
+        Returns the output, with the examples of every individual stacked
+        as (population_size * num_examples, ...), and whether it is shared,
+        i.e. no layer with params was applied and the output is still
+        (num_examples, ...) and the same for every individual.
+        '''
+        branch_params = params_list[0]
+        param_i = 1
+        inputs = []
+        shared = []
+        for input in self.inputs:
+            if isinstance(input, np.ndarray):
+                inputs.append(data_tensors.pop(0))
+                shared.append(True)
+            else:
+                output, is_shared = input.get_population_output(
+                    params_list[param_i:], data_tensors, population_size,
+                    testing)
+                param_i += 1
+                inputs.append(output)
+                shared.append(is_shared)
+        if self.merge_mode != 'flat_append':
+            raise Exception('Invalid merge mode')
+        x_shared = all(shared)
+        if len(inputs) > 1:
+            inputs = [input.flatten(2) for input in inputs]
+            if not x_shared:
+                inputs = [T.tile(input, (population_size, 1))
+                          if is_shared else input
+                          for input, is_shared in zip(inputs, shared)]
+            x = T.concatenate(inputs, axis=1)
+        else:
+            x = inputs[0]
+        for layer, params in zip(self.layers, branch_params):
+            x = layer.get_population_output(x, params, population_size,
+                                            x_shared, testing)
+            x_shared = x_shared and params is None
+        return x.astype('float32'), x_shared
 
 
 class Model():
@@ -163,6 +395,8 @@ class Model():
         self.set_optimizer(Optimizers.RMSprop())
         self.set_dream_optimizer(Optimizers.RMSprop(learning_rate=0.1, momentum=0.99))
         self.outputs = []
+        self.metrics = []
+        self.stop_training = False
 
     def save_params(self, filename='okapi_params.pk'):
         file = open(filename, 'wb')
@@ -171,8 +405,18 @@ class Model():
 
     def load_params(self, filename='okapi_params.pk'):
         file = open(filename, 'rb')
-        self.params_shared = pickle.load(file)
+        params_shared = pickle.load(file)
         file.close()
+        if not self.compiled:
+            self.params_shared = params_shared
+            self.bind_params_buffer()
+            return
+        values = [params.get_value(borrow=True).ravel()
+                  for branch_params in params_shared
+                  for layer_params in branch_params
+                  if layer_params is not None
+                  for params in layer_params]
+        self.set_params_as_vec(np.concatenate(values))
 
     def set_optimizer(self, optimizer):
         self.optimizer = optimizer
@@ -189,6 +433,10 @@ class Model():
     def add_output(self, output):
         self.outputs.append(output)
 
+    def add_metric(self, name, metric):
+        '''Registers an Accuracies.Accuracy reported by the fused train step.'''
+        self.metrics.append((name, metric))
+
     def get_init_params(self):
         init_params = self.tree.get_init_params([])
         return init_params
@@ -207,101 +455,598 @@ class Model():
                     layer_params_shared = None
                 branch_params_shared.append(layer_params_shared)
             self.params_shared.append(branch_params_shared)
+        self.bind_params_buffer()
 
     def randomize_params(self):
-        rand_params = self.get_init_params()
-        for current_params, new_params in zip(self.params_shared, rand_params):
-            if current_params is not None:
-                for current, rand in zip(current_params, new_params):
-                    current.set_value(rand)
+        rand_params = [params.ravel()
+                       for branch_params in self.get_init_params()
+                       for layer_params in branch_params
+                       if layer_params is not None
+                       for params in layer_params]
+        self.set_params_as_vec(np.concatenate(rand_params))
+
+    def sync_params_buffer(self, copy=True):
+        '''Re-aliases the shared variables to their views of params_buffer.
+
+        Theano may replace a shared variable's storage when it applies an
+        update, leaving the buffer stale. Every variable whose value is no
+        longer its view is copied back (unless copy is False) and rebound,
+        so this only costs an identity check per variable when nothing has
+        moved.
+        '''
+        if getattr(self, 'params_buffer', None) is None:
+            self.bind_params_buffer()
+            return
+        for params, view in zip(self.params_list, self.params_views):
+            value = params.get_value(borrow=True)
+            if value is not view:
+                if copy:
+                    view[...] = value
+                params.set_value(view, borrow=True)
 
     def set_params_as_vec(self, params):
-        index = 0
-        params = params.astype('float32')
-        for branch_params in self.params_shared:
-            for layer_params in branch_params:
-                if layer_params is not None:
-                    for shared in layer_params:
-                        shape = shared.get_value().shape
-                        size = np.prod(shape)
-                        new_params = params[index:index + size].reshape(shape)
-                        shared.set_value(new_params)
-                        index += size
+        '''Copies a flat parameter vector into the parameter buffer.'''
+        self.sync_params_buffer(copy=False)
+        self.params_buffer[:] = params
 
     def get_params_as_vec(self):
-        vec = []
-        for branch_params in self.params_shared:
-            for layer_params in branch_params:
-                if layer_params is not None:
-                    for params in layer_params:
-                        vec = np.append(vec, params.get_value().flat)
-        return vec
+        '''Returns a copy of the flat parameter buffer.'''
+        self.sync_params_buffer()
+        return self.params_buffer.copy()
+
+    def set_param(self, index, value):
+        '''Sets a single coordinate of the flat parameter vector.'''
+        self.sync_params_buffer()
+        self.params_buffer[index] = value
+
+    def get_param(self, index):
+        self.sync_params_buffer()
+        return self.params_buffer[index]
+
+    def bind_params_buffer(self, buffer=None, copy=True):
+        '''Backs every parameter by a view into one flat float32 buffer.
+
+        The shared variables borrow their views, so writes to the buffer
+        are seen by the compiled functions. With copy=False the current
+        parameter values are not copied in, e.g. when the buffer already
+        holds them.
+        '''
+        all_params = self.get_all_params()
+        values = [params.get_value(borrow=True) for params in all_params]
+        if buffer is None:
+            buffer = np.empty(sum(value.size for value in values),
+                              dtype='float32')
+        index = 0
+        views = []
+        for params, value in zip(all_params, values):
+            view = buffer[index:index + value.size].reshape(value.shape)
+            if copy:
+                view[...] = value
+            params.set_value(view, borrow=True)
+            views.append(view)
+            index += value.size
+        self.params_buffer = buffer
+        self.params_list = all_params
+        self.params_views = views
+        return buffer
+
+    def __getstate__(self):
+        # Pickling copies each view into an array of its own, so the
+        # buffer is dropped and rebound on load.
+        state = self.__dict__.copy()
+        for name in ('params_buffer', 'params_list', 'params_views'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if getattr(self, 'params_shared', None) is not None:
+            self.bind_params_buffer()
 
     def set_tree(self, tree):
         self.tree = tree
 
-    def compile(self, x_train, y_train, initialize_params=True):
+    def compile(self, x_train, y_train, initialize_params=True,
+                resident=False):
+        '''Prepares the model for use without compiling anything yet.
+
+        Each theano function is built the first time it is requested
+        through get_function and memoized until the next compile, so a
+        predict-only workflow never builds the training graph.
+        '''
         print('Compiling model...')
-        self.compiled = True
         try:
             self.num_output_dims
         except:
             self.num_output_dims = y_train.ndim
-        y_train = atleast_4d(y_train)
+        y_train = expand_4d(y_train)
         for i in range(len(x_train)):
-            x_train[i] = atleast_4d(x_train[i])
+            x_train[i] = expand_4d(x_train[i])
         self.tree.set_final_output_shape(y_train.shape)
+        self.prepare(initialize_params)
+        if resident:
+            self.set_resident_data(x_train, y_train)
+
+    def prepare(self, initialize_params=True):
+        '''Sets up the symbolic inputs without any data. The output shape
+        of the tree must already be final and num_output_dims set, as for a
+        model rebuilt by Serialization.load.
+        '''
+        self.compiled = True
+        self.functions = {}
+        self.graphs = {}
+        self.x_shared = None
+        self.y_shared = None
+        self.genomes_shared = None
         if initialize_params:
             self.initialize_params()
 
-        y = T.tensor4(dtype='float32')
+        self.y_input = T.tensor4(dtype='float32')
         num_data_inputs = self.tree.get_num_data_inputs()
-        data_inputs = []
+        self.data_inputs = []
         for i in range(num_data_inputs):
-            data_inputs.append(T.tensor4(dtype='float32'))
+            self.data_inputs.append(T.tensor4(dtype='float32'))
 
-        y_hat, layer_updates = self.tree.get_output(self.params_shared, data_inputs[:], False)
-        y_hat_test, layer_updates = self.tree.get_output(self.params_shared, data_inputs[:], True)
+    def get_function(self, name, *args):
+        key = (name,) + args
+        if key not in self.functions:
+            self.functions[key] = getattr(self, 'build_' + name)(*args)
+        return self.functions[key]
 
+    def get_output_graph(self, testing):
+        key = 'test_output' if testing else 'train_output'
+        if key not in self.graphs:
+            self.graphs[key] = self.tree.get_output(
+                self.params_shared, self.data_inputs[:], testing)
+        return self.graphs[key]
+
+    def get_all_params(self):
         all_params = []
         for branch_params in self.params_shared:
             for layer_params in branch_params:
                 if layer_params is not None:
                     for params in layer_params:
                         all_params.append(params)
+        return all_params
+
+    def get_train_loss_graph(self):
+        if 'train_loss' not in self.graphs:
+            y_hat, layer_updates = self.get_output_graph(False)
+            self.graphs['train_loss'] = self.loss.get_train_loss(
+                y_hat, self.y_input, self.get_all_params())
+        return self.graphs['train_loss']
+
+    def init_optimizer(self):
+        if 'optimizer' not in self.graphs:
+            self.optimizer.build(self.get_all_params())
+            self.graphs['optimizer'] = self.optimizer
+
+    def get_step_updates(self):
+        if 'updates' not in self.graphs:
+            self.init_optimizer()
+            all_params = self.get_all_params()
+            train_loss = self.get_train_loss_graph()
+            y_hat, layer_updates = self.get_output_graph(False)
+            updates = cast_updates(
+                self.optimizer.get_updates(all_params, train_loss))
+            updates += layer_updates
+            self.graphs['updates'] = updates
+        return self.graphs['updates']
+
+    def get_grad_accumulators(self):
+        if 'grad_accumulators' not in self.graphs:
+            accumulators = []
+            for params in self.get_all_params():
+                shape = params.get_value(borrow=True).shape
+                accumulators.append(
+                    theano.shared(np.zeros(shape, dtype='float32')))
+            count = theano.shared(np.float32(0))
+            self.graphs['grad_accumulators'] = (accumulators, count)
+        return self.graphs['grad_accumulators']
+
+    def get_train_metrics_graph(self):
+        if 'train_metrics' not in self.graphs:
+            y_hat, layer_updates = self.get_output_graph(False)
+            metrics = [self.accuracy.get_accuracy(y_hat, self.y_input)]
+            for name, metric in self.metrics:
+                metrics.append(metric.get_accuracy(y_hat, self.y_input))
+            self.graphs['train_metrics'] = metrics
+        return self.graphs['train_metrics']
+
+    def get_step_outputs(self, metrics):
+        if metrics:
+            return [self.get_train_loss_graph()] + \
+                self.get_train_metrics_graph()
+        return self.get_train_loss_graph()
+
+    def build_train_loss(self):
+        return theano.function(self.data_inputs + [self.y_input],
+                               self.get_train_loss_graph())
+
+    def build_test_loss(self):
+        y_hat_test, layer_updates = self.get_output_graph(True)
+        test_loss = self.loss.get_test_loss(y_hat_test, self.y_input,
+                                            self.get_all_params())
+        return theano.function(self.data_inputs + [self.y_input], test_loss)
 
-        train_loss = self.loss.get_train_loss(y_hat, y, all_params)
-        test_loss = self.loss.get_test_loss(y_hat_test, y, all_params)
-        test_acc = self.accuracy.get_accuracy(y_hat_test, y)
+    def build_test_acc(self):
+        y_hat_test, layer_updates = self.get_output_graph(True)
+        test_acc = self.accuracy.get_accuracy(y_hat_test, self.y_input)
+        return theano.function(self.data_inputs + [self.y_input], test_acc)
 
+    def build_predict(self):
+        y_hat_test, layer_updates = self.get_output_graph(True)
         preds = y_hat_test.flatten(self.num_output_dims)
+        return theano.function(self.data_inputs, preds)
 
-        self.optimizer.build(all_params)
-        updates = list(self.optimizer.get_updates(all_params, train_loss))
-        for i, update in enumerate(updates):
-            updates[i] = (update[0], update[1].astype('float32'))
-        updates += layer_updates
+    def build_evaluate(self, top_k=None, confusion=False):
+        y_hat_test, layer_updates = self.get_output_graph(True)
+        num_examples = y_hat_test.shape[0].astype('float32')
+        test_loss = self.loss.get_test_loss(y_hat_test, self.y_input,
+                                            self.get_all_params())
+        metrics = [self.accuracy] + [metric for name, metric in self.metrics]
+        if top_k is not None:
+            metrics.append(Accuracies.TopK(top_k))
+        outputs = [test_loss * num_examples]
+        for metric in metrics:
+            outputs.append(metric.get_accuracy(y_hat_test, self.y_input) *
+                           num_examples)
+        if confusion:
+            outputs.append(Accuracies.confusion_matrix(y_hat_test,
+                                                       self.y_input))
+        return theano.function(self.data_inputs + [self.y_input], outputs)
+
+    def build_step_function(self, outputs, updates, indexed=False):
+        if not indexed:
+            return theano.function(
+                inputs=self.data_inputs + [self.y_input],
+                outputs=outputs,
+                updates=updates)
+        if self.x_shared is None:
+            raise Exception('No resident data, call set_resident_data first')
+        index = T.ivector()
+        givens = []
+        for data_input, x_shared in zip(self.data_inputs, self.x_shared):
+            givens.append((data_input, x_shared[index]))
+        givens.append((self.y_input, self.y_shared[index]))
+        return theano.function(
+            inputs=[index],
+            outputs=outputs,
+            updates=updates,
+            givens=givens)
+
+    def build_update_step(self, metrics=False):
+        return self.build_step_function(self.get_step_outputs(metrics),
+                                        self.get_step_updates())
+
+    def build_update_step_indexed(self, metrics=False):
+        return self.build_step_function(self.get_step_outputs(metrics),
+                                        self.get_step_updates(),
+                                        indexed=True)
+
+    def build_accumulate_step(self, indexed=False, metrics=False):
+        '''Adds the batch gradients, weighted by batch size, to the
+        gradient accumulators without touching the parameters.'''
+        all_params = self.get_all_params()
+        train_loss = self.get_train_loss_graph()
+        y_hat, layer_updates = self.get_output_graph(False)
+        accumulators, count = self.get_grad_accumulators()
+        num_examples = y_hat.shape[0].astype('float32')
+        grads = T.grad(train_loss, all_params)
+        updates = []
+        for accumulator, grad in zip(accumulators, grads):
+            updates.append((accumulator, accumulator + grad * num_examples))
+        updates.append((count, count + num_examples))
+        updates = cast_updates(updates) + layer_updates
+        return self.build_step_function(self.get_step_outputs(metrics),
+                                        updates, indexed)
+
+    def build_apply_step(self):
+        '''Applies the optimizer to the mean accumulated gradient and
+        resets the accumulators.'''
+        self.init_optimizer()
+        all_params = self.get_all_params()
+        accumulators, count = self.get_grad_accumulators()
+        grads = [accumulator / count for accumulator in accumulators]
+        updates = cast_updates(
+            self.optimizer.get_grad_updates(all_params, grads))
+        for accumulator in accumulators:
+            updates.append((accumulator, T.zeros_like(accumulator)))
+        updates.append((count, T.zeros_like(count)))
+        return theano.function(inputs=[], outputs=[], updates=updates)
 
-        all_inputs = data_inputs + [y]
+    def build_grad_vec(self):
+        '''Returns the training loss and its gradient as one flat vector.'''
+        all_params = self.get_all_params()
+        train_loss = self.get_train_loss_graph()
+        y_hat, layer_updates = self.get_output_graph(False)
+        grads = T.grad(train_loss, all_params)
+        grad_vec = T.concatenate([grad.flatten() for grad in grads])
+        return theano.function(self.data_inputs + [self.y_input],
+                               [train_loss, grad_vec.astype('float32')],
+                               updates=layer_updates)
 
-        self.train_loss_theano = theano.function(all_inputs, train_loss)
-        self.test_loss_theano = theano.function(all_inputs, test_loss)
-        self.test_acc_theano = theano.function(all_inputs, test_acc)
-        self.predict_theano = theano.function(data_inputs, preds)
-        self.update_step = theano.function(
-            inputs=all_inputs,
-            outputs=train_loss,
-            updates=updates)
+    def build_apply_grad_vec(self):
+        self.init_optimizer()
+        all_params = self.get_all_params()
+        grad_vec = T.fvector()
+        grads = []
+        index = 0
+        for params in all_params:
+            shape = params.get_value(borrow=True).shape
+            size = int(np.prod(shape))
+            grads.append(grad_vec[index:index + size].reshape(shape))
+            index += size
+        updates = cast_updates(
+            self.optimizer.get_grad_updates(all_params, grads))
+        return theano.function([grad_vec], [], updates=updates)
+
+    def get_grad_vec(self, x, y):
+        for i in range(len(x)):
+            x[i] = atleast_4d(x[i])
+        y = atleast_4d(y)
+        return self.get_function('grad_vec')(*x, y)
+
+    def apply_grad_vec(self, grad_vec):
+        self.get_function('apply_grad_vec')(grad_vec.astype('float32',
+                                                            copy=False))
+
+    @property
+    def train_loss_theano(self):
+        return self.get_function('train_loss')
+
+    @property
+    def test_loss_theano(self):
+        return self.get_function('test_loss')
+
+    @property
+    def test_acc_theano(self):
+        return self.get_function('test_acc')
 
-    def predict(self, x):
+    @property
+    def predict_theano(self):
+        return self.get_function('predict')
+
+    @property
+    def update_step(self):
+        return self.get_function('update_step', False)
+
+    @property
+    def update_step_indexed(self):
+        return self.get_function('update_step_indexed', False)
+
+    def set_resident_data(self, x, y):
+        '''Keeps the training set in shared storage for update_step_indexed.
+
+        update_step_indexed takes an int32 vector of example indices and
+        slices its batch out of the shared data through givens, so no
+        arrays are passed into the compiled function on each step.
+        '''
         for i in range(len(x)):
             x[i] = atleast_4d(x[i])
-        preds_theano = self.predict_theano(*x)
+        y = atleast_4d(y)
+        if self.x_shared is not None:
+            for x_shared, x_input in zip(self.x_shared, x):
+                x_shared.set_value(x_input, borrow=True)
+            self.y_shared.set_value(y, borrow=True)
+            return
+        self.x_shared = [theano.shared(x_input, borrow=True)
+                         for x_input in x]
+        self.y_shared = theano.shared(y, borrow=True)
+
+    def predict(self, x, batch_size=1024, filename=None):
+        '''Predicts in chunks of batch_size examples.
+
+        Chunks are written into one preallocated float32 array, which is an
+        .npy memmap at filename when given, so only one chunk of activations
+        is ever held at once.
+        '''
+        for i in range(len(x)):
+            x[i] = expand_4d(x[i])
+        num_examples = x[0].shape[0]
+        if num_examples == 0:
+            raise Exception('Cannot predict on zero examples')
+        if batch_size is None:
+            batch_size = num_examples
+        predict_step = self.predict_theano
+        preds_theano = None
+        for start in range(0, num_examples, batch_size):
+            x_batch = [atleast_4d(x_input[start:start + batch_size])
+                       for x_input in x]
+            batch_preds = predict_step(*x_batch)
+            rows = batch_preds.shape[0] // x_batch[0].shape[0]
+            if preds_theano is None:
+                shape = (num_examples * rows,) + batch_preds.shape[1:]
+                if filename is None:
+                    preds_theano = np.empty(shape, dtype='float32')
+                else:
+                    preds_theano = np.lib.format.open_memmap(
+                        filename, mode='w+', dtype='float32', shape=shape)
+            preds_theano[start * rows:start * rows + batch_preds.shape[0]] = \
+                batch_preds
+        if filename is not None:
+            preds_theano.flush()
+        if not self.outputs:
+            return [preds_theano]
         preds = []
         for dim in [output.shape for output in self.outputs]:
             preds.append(preds_theano[:sum(dim)])
         return preds
 
+    def build_profile(self):
+        '''Returns the functions timed by profile: the forward pass up to
+        the merged inputs and every root branch layer's output, then the
+        backward pass from the loss down to every layer's input and params,
+        first layer first and the loss alone last.
+        '''
+        merged, layer_outputs, updates = self.tree.get_layer_outputs(
+            self.params_shared, self.data_inputs[:], False)
+        layers = self.tree.layers
+        layer_params = [params if params is not None else []
+                        for params in self.params_shared[0]]
+        layer_inputs = [merged] + layer_outputs[:-1]
+        all_inputs = self.data_inputs + [self.y_input]
+        train_loss = self.loss.get_train_loss(
+            layer_outputs[-1].astype('float32'), self.y_input,
+            self.get_all_params())
+
+        def build(outputs, name):
+            return theano.function(all_inputs, outputs, name=name,
+                                   on_unused_input='ignore')
+
+        # Layers may return their input unchanged, so the symbolic outputs
+        # are not renamed; the functions are named after the layers instead.
+        names = ['{}:{}'.format(i, type(layer).__name__)
+                 for i, layer in enumerate(layers)]
+        forward_functions = [build(merged, 'inputs forward')]
+        for output, name in zip(layer_outputs, names):
+            forward_functions.append(build(output, name + ' forward'))
+        backward_functions = [build(train_loss, 'loss')]
+        for i in reversed(range(len(layers))):
+            wrt = [layer_inputs[i]]
+            for params in layer_params[i:]:
+                wrt += params
+            grads = T.grad(train_loss, wrt)
+            backward_functions.insert(0, build(
+                grads, names[i] + ' backward'))
+        return forward_functions, backward_functions
+
+    def profile(self, x, y, n_batches=10, batch_size=128, repeats=3):
+        '''Prints the forward and backward time of every root branch layer.
+
+        Layer i's forward time is the time of the forward pass up to its
+        output minus the pass up to its input. Its backward time is the time
+        of backpropagating the training loss down to its input and params
+        minus backpropagating down to its output. Every function is timed
+        on the same n_batches, keeping the best of repeats runs, and is
+        named after its layer so THEANO_FLAGS=profile=True reports per layer
+        as well. The functions are compiled once per model, and the params
+        and optimizer state advanced by timing the update step are restored
+        afterwards.
+        '''
+        for i in range(len(x)):
+            x[i] = expand_4d(x[i])
+        y = expand_4d(y)
+        batches = BatchIterator(x, y, batch_size, shuffle=False)
+        batches = [[atleast_4d(x_input) for x_input in x_batch] +
+                   [atleast_4d(y_batch)]
+                   for x_batch, y_batch in
+                   itertools.islice(batches, n_batches)]
+
+        def time_function(function):
+            times = []
+            for i in range(repeats):
+                start = time.perf_counter()
+                for batch in batches:
+                    function(*batch)
+                times.append(time.perf_counter() - start)
+            return min(times) / len(batches)
+
+        forward_functions, backward_functions = \
+            self.get_function('profile')
+        forward_times = [time_function(function)
+                         for function in forward_functions]
+        backward_times = [time_function(function)
+                          for function in backward_functions]
+        update_step = self.get_function('update_step', False)
+        state = [(shared, shared.get_value())
+                 for shared, update in self.get_step_updates()]
+        try:
+            step_time = time_function(update_step)
+        finally:
+            for shared, value in state:
+                shared.set_value(value)
+            self.sync_params_buffer()
+
+        layers = self.tree.layers
+        results = []
+        print('{:<4}{:<20}{:>14}{:>15}{:>10}'.format(
+            '#', 'Layer', 'Forward (ms)', 'Backward (ms)', '% Step'))
+        for i, layer in enumerate(layers):
+            forward = max(forward_times[i + 1] - forward_times[i], 0)
+            backward = max(backward_times[i] - backward_times[i + 1], 0)
+            percent = (forward + backward) / step_time * 100
+            results.append({'index': i,
+                            'layer': type(layer).__name__,
+                            'forward': forward,
+                            'backward': backward,
+                            'percent': percent})
+            print('{:<4}{:<20}{:>14.3f}{:>15.3f}{:>10.1f}'.format(
+                i, type(layer).__name__, forward * 1000, backward * 1000,
+                percent))
+        print('Step: {:.3f}ms per batch of {}'.format(step_time * 1000,
+                                                      batch_size))
+        return results
+
+    def get_population_params(self, genomes, population_size):
+        '''Slices a (population_size, num_params) genome matrix, laid out
+        like get_params_as_vec, into the structure of params_shared with a
+        leading population axis on every param.
+        '''
+        index = 0
+        population_params = []
+        for branch_params in self.params_shared:
+            branch_population = []
+            for layer_params in branch_params:
+                if layer_params is None:
+                    branch_population.append(None)
+                    continue
+                layer_population = []
+                for params in layer_params:
+                    shape = params.get_value(borrow=True).shape
+                    size = int(np.prod(shape))
+                    layer_population.append(
+                        genomes[:, index:index + size]
+                        .reshape((population_size,) + shape))
+                    index += size
+                branch_population.append(layer_population)
+            population_params.append(branch_population)
+        return population_params
+
+    def build_population_loss(self, population_size):
+        '''Returns the test loss of every genome in genomes_shared on a
+        batch, computed by one batched forward pass.'''
+        params_list = self.get_population_params(self.genomes_shared,
+                                                 population_size)
+        y_hat, shared = self.tree.get_population_output(
+            params_list, self.data_inputs[:], population_size)
+        y_hat = y_hat.flatten(2)
+        if shared:
+            y_hat = T.tile(y_hat, (population_size, 1))
+        y = T.tile(self.y_input.flatten(2), (population_size, 1))
+        losses = self.loss.get_example_losses(y_hat, y)
+        return theano.function(
+            self.data_inputs + [self.y_input],
+            losses.reshape((population_size, -1)).mean(axis=1))
+
+    def set_population(self, genomes):
+        genomes = np.ascontiguousarray(genomes, dtype='float32')
+        if self.genomes_shared is None:
+            self.genomes_shared = theano.shared(genomes, borrow=True)
+        else:
+            self.genomes_shared.set_value(genomes, borrow=True)
+
+    def get_population_loss(self, genomes, x, y, batch_size=128):
+        '''Returns the test loss of every row of genomes, a
+        (population_size, num_params) matrix of flat parameter vectors.
+
+        The genomes are uploaded once as a shared matrix and every batch is
+        run through all of them in a single compiled function, so the
+        activations of a batch take population_size times the memory of
+        get_test_loss and batch_size should be smaller accordingly.
+        '''
+        population_size = genomes.shape[0]
+        self.set_population(genomes)
+        population_loss = self.get_function('population_loss',
+                                            population_size)
+        for i in range(len(x)):
+            x[i] = expand_4d(x[i])
+        y = expand_4d(y)
+        losses = np.zeros(population_size)
+        for x_batch, y_batch in get_batches(x, y, batch_size, False):
+            losses += population_loss(*x_batch, y_batch) * y_batch.shape[0]
+        return losses / y.shape[0]
+
     def get_train_loss(self, x, y):
         for i in range(len(x)):
             x[i] = atleast_4d(x[i])
@@ -314,16 +1059,46 @@ class Model():
         y = atleast_4d(y)
         return self.test_loss_theano(*x, y)
 
-    def get_accuracy(self, x, y, batch_size=128, shuffle=True):
+    def get_accuracy(self, x, y, batch_size=128, shuffle=False, prefetch=0):
+        results = self.evaluate(x, y, batch_size, shuffle=shuffle,
+                                prefetch=prefetch)
+        return results['accuracy'] * 100
+
+    def evaluate(self, x, y, batch_size=128, top_k=None, confusion=False,
+                 shuffle=False, prefetch=0):
+        '''Computes every metric in a single streaming pass over the data.
+
+        Returns a dict with the loss, accuracy, registered metrics and
+        optionally the top_k accuracy and confusion matrix. Batch results
+        are weighted by batch size, so uneven final batches are exact.
+        '''
         for i in range(len(x)):
-            x[i] = atleast_4d(x[i])
-        y = atleast_4d(y)
-        x_batches, y_batches, num_batches = make_batches(
-            x, y, batch_size, shuffle=shuffle)
-        accuracy = 0
-        for x_batch, y_batch in zip(x_batches, y_batches):
-            accuracy += self.test_acc_theano(*x_batch, y_batch)
-        return accuracy / num_batches * 100
+            x[i] = expand_4d(x[i])
+        y = expand_4d(y)
+        if y.shape[0] == 0:
+            raise Exception('Cannot evaluate on zero examples')
+        evaluate_step = self.get_function('evaluate', top_k, confusion)
+        batches = get_batches(x, y, batch_size, shuffle, prefetch)
+        totals = None
+        for x_batch, y_batch in batches:
+            outputs = evaluate_step(*x_batch, y_batch)
+            if totals is None:
+                totals = [np.asarray(output, dtype='float64')
+                          for output in outputs]
+            else:
+                for total, output in zip(totals, outputs):
+                    total += output
+        num_examples = y.shape[0]
+        names = ['loss', 'accuracy'] + \
+            [name for name, metric in self.metrics]
+        if top_k is not None:
+            names.append('top_{}_accuracy'.format(top_k))
+        results = {}
+        for name, total in zip(names, totals):
+            results[name] = float(total) / num_examples
+        if confusion:
+            results['confusion_matrix'] = totals[-1].astype('int64')
+        return results
 
     def get_dream_accuracy(self, x, y, max_dream_length=24,
             initializer=Initializers.zeros):
@@ -333,13 +1108,16 @@ class Model():
         return accuracy * 100, preds
 
     def write_progress(self, epoch, num_epochs, batch_num, num_batches,
-                       time, loss):
-        progress = ("\rEpoch {}/{} | Batch {}/{} | Time: {}s | Loss: {}   "
+                       time, loss, metrics=None):
+        progress = ("\rEpoch {}/{} | Batch {}/{} | Time: {}s | Loss: {}"
                     .format(epoch + 1, num_epochs,
                             batch_num + 1, num_batches,
                             round(time, 1),
                             loss))
-        sys.stdout.write(progress)
+        if metrics is not None:
+            for name, value in metrics:
+                progress += ' | {}: {}'.format(name, round(value, 4))
+        sys.stdout.write(progress + '   ')
 
     def est_time_remaining(self, last_time, iteration, num_iterations):
         iterations_left = num_iterations - iteration - 1
@@ -417,39 +1195,120 @@ class Model():
         return predictions
 
     def train(self, x, y, num_epochs=12, shuffle=True,
-              params_filename='okapi_params.pk',
+              params_filename=None,
               initialize_params=True,
-              batch_size=128):
+              batch_size=128,
+              prefetch=0,
+              resident=False,
+              show_accuracy=False,
+              chunk_size=None,
+              accumulate_steps=1,
+              callbacks=None,
+              verbose=True):
+        '''Trains for num_epochs over shuffled batches of batch_size.
+
+        With accumulate_steps=k each batch is split into k micro-batches
+        whose size-weighted gradients are accumulated before a single
+        optimizer update, so only a micro-batch of activations is held at
+        once while the updates match those of the full batch. batch_size
+        must be divisible by accumulate_steps.
+
+        callbacks is a list of Callbacks.Callback hooks. With verbose a
+        rate-limited Callbacks.ProgressReporter is added unless one is
+        already given. Setting stop_training from a callback ends training
+        after the current batch. Given params_filename, the params are
+        saved to it at the end of every epoch by a Callbacks.ParamsSaver.
+
+        Returns a list with the Telemetry.EpochStats of every epoch.
+        '''
         self.num_output_dims = y.ndim
         for i in range(len(x)):
-            x[i] = atleast_4d(x[i])
-        y = atleast_4d(y)
+            x[i] = expand_4d(x[i])
+        y = expand_4d(y)
         if not self.compiled:
             self.compile(x, y, initialize_params=initialize_params)
-        x_batches, y_batches, num_batches = make_batches(
-            x, y, batch_size, shuffle)
-        print('Started training...')
+        if accumulate_steps > 1:
+            if batch_size % accumulate_steps != 0:
+                raise ValueError('batch_size {} is not divisible by '
+                                 'accumulate_steps {}'.format(
+                                     batch_size, accumulate_steps))
+            batch_size //= accumulate_steps
+            apply_step = self.get_function('apply_step')
+        if resident:
+            self.set_resident_data(x, y)
+            batches = BatchIterator(x, y, batch_size, shuffle, num_buffers=0,
+                                    chunk_size=chunk_size)
+        else:
+            batches = get_batches(x, y, batch_size, shuffle, prefetch,
+                                  chunk_size)
+        num_batches = len(batches)
+        if accumulate_steps > 1:
+            update_step = self.get_function('accumulate_step', resident,
+                                            show_accuracy)
+        elif resident:
+            update_step = self.get_function('update_step_indexed',
+                                            show_accuracy)
+        else:
+            update_step = self.get_function('update_step', show_accuracy)
+        metric_names = ['Acc'] + [name for name, metric in self.metrics]
+        if params_filename is not None:
+            callbacks = list(callbacks) if callbacks is not None else []
+            callbacks.append(Callbacks.ParamsSaver(params_filename))
+        callbacks = Callbacks.get_callback_list(callbacks, self, verbose)
+        telemetry = Telemetry.Telemetry(num_batches)
+        logs = {'num_epochs': num_epochs, 'num_batches': num_batches,
+                'loss': None, 'metrics': None, 'stats': None,
+                'telemetry': telemetry}
+        self.stop_training = False
+        if verbose:
+            print('Started training...')
+        callbacks.on_train_begin(logs)
         for epoch in range(num_epochs):
-            epoch_start = time.clock()
-            if shuffle:
-                x_batches, y_batches, num_batches = make_batches(
-                    x, y, batch_size, shuffle=True)
+            callbacks.on_epoch_begin(epoch, logs)
+            telemetry.begin_epoch(epoch)
             total_loss = 0
-            for x_batch, y_batch, batch_num in zip(
-                    x_batches, y_batches, range(num_batches)):
-                batch_start = time.clock()
-                loss = self.update_step(*x_batch, y_batch)
+            num_seen = 0
+            metric_totals = np.zeros(len(metric_names))
+            if resident:
+                batch_iter = batches.iter_indices()
+            else:
+                batch_iter = iter(batches)
+            for batch_num, batch in enumerate(batch_iter):
+                telemetry.mark_data()
+                if resident:
+                    outputs = update_step(batch)
+                    batch_examples = len(batch)
+                else:
+                    x_batch, y_batch = batch
+                    outputs = update_step(*x_batch, y_batch)
+                    batch_examples = y_batch.shape[0]
+                if show_accuracy:
+                    loss = outputs[0]
+                    num_seen += batch_examples
+                    metric_totals += np.asarray(outputs[1:]) * batch_examples
+                    logs['metrics'] = list(zip(metric_names,
+                                               metric_totals / num_seen))
+                else:
+                    loss = outputs
+                pending = accumulate_steps > 1 and \
+                    (batch_num + 1) % accumulate_steps != 0 and \
+                    batch_num != num_batches - 1
+                if accumulate_steps > 1 and not pending:
+                    apply_step()
+                telemetry.mark_step(batch_examples)
                 total_loss += loss
-                batch_time = time.clock() - batch_start
-                time_rem = self.est_time_remaining(
-                    batch_time, batch_num, num_batches)
-                self.write_progress(epoch, num_epochs,
-                                    batch_num, num_batches,
-                                    time_rem, loss)
-
-            epoch_time = time.clock() - epoch_start
-            avg_loss = total_loss / num_batches
-            self.write_progress(epoch, num_epochs,
-                                num_batches - 1, num_batches,
-                                epoch_time, avg_loss)
-            print()
+                logs['loss'] = loss
+                callbacks.on_batch_end(epoch, batch_num, logs)
+                telemetry.mark_report()
+                if self.stop_training:
+                    if pending:
+                        apply_step()
+                    break
+
+            avg_loss = total_loss / max(telemetry.batch_num, 1)
+            logs['stats'] = telemetry.end_epoch(avg_loss)
+            callbacks.on_epoch_end(epoch, logs)
+            if self.stop_training:
+                break
+        callbacks.on_train_end(logs)
+        return telemetry.history
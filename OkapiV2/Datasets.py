@@ -2,6 +2,8 @@ import numpy as np
 from urllib.request import urlretrieve
 import gzip
 import os
+import pickle
+import tarfile
 
 
 def get_file(filename, source, offset=16):
@@ -52,3 +54,31 @@ def load_mnist(val_size=10000):
     x_train, y_train, x_val, y_val = get_val_set(x_train, y_train, val_size)
 
     return x_train, y_train, x_val, y_val, x_test, y_test
+
+
+def load_cifar10(val_size=5000):
+    print("Loading data...")
+    source = 'https://www.cs.toronto.edu/~kriz/'
+    folder = 'cifar-10-batches-py'
+
+    def load_cifar10_batch(filename):
+        with open(os.path.join(folder, filename), 'rb') as f:
+            batch = pickle.load(f, encoding='latin1')
+        data = batch['data'].reshape(-1, 3, 32, 32)
+        return data / np.float32(256), np.asarray(batch['labels'])
+
+    if not os.path.exists(os.path.join(folder, 'test_batch')):
+        download('cifar-10-python.tar.gz', source)
+        with tarfile.open('cifar-10-python.tar.gz', 'r:gz') as f:
+            f.extractall()
+
+    batches = [load_cifar10_batch('data_batch_{}'.format(i))
+               for i in range(1, 6)]
+    x_train = np.concatenate([batch[0] for batch in batches])
+    y_train = np.concatenate([batch[1] for batch in batches])
+    x_test, y_test = load_cifar10_batch('test_batch')
+
+    y_train, y_test = vec_to_onehot(y_train), vec_to_onehot(y_test)
+    x_train, y_train, x_val, y_val = get_val_set(x_train, y_train, val_size)
+
+    return x_train, y_train, x_val, y_val, x_test, y_test
@@ -0,0 +1,150 @@
+'''Vectorized genetic operators.
+
+A population is a (population_size, genome_size) matrix with one genome per
+row. Self-adaptive genomes end in three rate genes, the mutation std, the
+mutation probability and the crossover probability, which evolve along with
+the params. Every operator works on whole matrices and takes an rng, the
+global np.random by default.
+'''
+import numpy as np
+
+NUM_RATE_GENES = 3
+MUT_STD, MUT_P, CROSS_P = -3, -2, -1
+
+
+def add_rate_genes(population, mut_std, mut_p, cross_p):
+    '''Appends the three rate genes to every genome.'''
+    rates = np.empty((population.shape[0], NUM_RATE_GENES),
+                     dtype=population.dtype)
+    rates[:] = (mut_std, mut_p, cross_p)
+    return np.concatenate([population, rates], axis=1)
+
+
+def mutate(population, mut_p, mut_std, num_genes=None, rng=np.random):
+    '''Adds uniform noise of std mut_std to each gene with probability
+    mut_p, in place. The noise lies in [-sqrt(3), sqrt(3)] * mut_std, the
+    distribution of Initializers.uniform(shape, mut_std). mut_p and
+    mut_std are scalars or hold one value per genome. Only the first
+    num_genes genes are mutated.
+    '''
+    genes = population[:, :num_genes]
+    mask = rng.random_sample(genes.shape) < np.reshape(mut_p, (-1, 1))
+    rows, cols = np.nonzero(mask)
+    scale = np.sqrt(3) * np.broadcast_to(mut_std, (genes.shape[0],))[rows]
+    genes[rows, cols] += rng.uniform(-1, 1, rows.shape[0]) * scale
+    return population
+
+
+def adapt_rates(population, tau=None, rng=np.random):
+    '''Perturbs the rate genes log-normally, in place. tau defaults to
+    1 / sqrt(genome_size), the usual self-adaptation learning rate.
+    '''
+    if tau is None:
+        tau = 1 / np.sqrt(population.shape[1])
+    rates = population[:, -NUM_RATE_GENES:]
+    rates *= np.exp(tau * rng.standard_normal(rates.shape))
+    np.clip(rates[:, 1:], 0, 1, out=rates[:, 1:])
+    return population
+
+
+def mutate_adaptive(population, tau=None, rng=np.random):
+    '''Adapts the rate genes, then mutates every other gene with its
+    genome's own mutation probability and std.
+    '''
+    adapt_rates(population, tau, rng)
+    return mutate(population, population[:, MUT_P], population[:, MUT_STD],
+                  -NUM_RATE_GENES, rng)
+
+
+def single_point_crossover(parents_a, parents_b, cross_p=1., rng=np.random):
+    '''With probability cross_p per pair, the child takes parents_a's genes
+    before a random point and parents_b's from it on. Otherwise it is a
+    copy of parents_a.
+    '''
+    num_pairs, genome_size = parents_a.shape
+    points = rng.randint(0, genome_size + 1, num_pairs)
+    points[rng.random_sample(num_pairs) >= cross_p] = genome_size
+    mask = np.arange(genome_size) >= points[:, np.newaxis]
+    return np.where(mask, parents_b, parents_a)
+
+
+def uniform_crossover(parents_a, parents_b, cross_p=1., swap_p=0.5,
+                      rng=np.random):
+    '''With probability cross_p per pair, the child takes each gene from
+    parents_b with probability swap_p. Otherwise it is a copy of parents_a.
+    '''
+    num_pairs = parents_a.shape[0]
+    crossed = rng.random_sample(num_pairs) < cross_p
+    mask = rng.random_sample(parents_a.shape) < swap_p
+    mask &= crossed[:, np.newaxis]
+    return np.where(mask, parents_b, parents_a)
+
+
+def tournament_select(fitness, num_selected, tournament_size=3,
+                      minimize=True, rng=np.random):
+    '''Returns the indices of the winners of num_selected tournaments
+    between tournament_size individuals drawn with replacement.
+    '''
+    contestants = rng.randint(0, fitness.shape[0],
+                              (num_selected, tournament_size))
+    scores = fitness[contestants]
+    winners = scores.argmin(axis=1) if minimize else scores.argmax(axis=1)
+    return contestants[np.arange(num_selected), winners]
+
+
+def roulette_select(fitness, num_selected, minimize=True, rng=np.random):
+    '''Returns num_selected indices drawn with probability proportional to
+    fitness rescaled to [0, 1], the worst individual scoring 0, by binary
+    search of the cumulative sums. Draws uniformly when every fitness is
+    equal.
+    '''
+    lowest, highest = fitness.min(), fitness.max()
+    if highest == lowest:
+        return rng.randint(0, fitness.shape[0], num_selected)
+    if minimize:
+        weights = (highest - fitness) / (highest - lowest)
+    else:
+        weights = (fitness - lowest) / (highest - lowest)
+    cumulative = np.cumsum(weights)
+    picks = rng.random_sample(num_selected) * cumulative[-1]
+    indices = np.searchsorted(cumulative, picks, side='right')
+    return np.minimum(indices, fitness.shape[0] - 1)
+
+
+def next_generation(population, fitness, num_survivors,
+                    select=roulette_select,
+                    crossover=single_point_crossover, tau=None,
+                    minimize=True, rng=np.random):
+    '''Returns the next generation of a self-adaptive population and the
+    fitness known for it.
+
+    The num_survivors fittest genomes are kept, first and sorted. The rest
+    are children of pairs of survivors picked by select, crossed over with
+    the first parent's crossover probability and mutated with their own
+    adaptive rates. Their fitness is NaN until evaluated.
+    '''
+    order = np.argsort(fitness if minimize else -fitness)[:num_survivors]
+    survivors = population[order]
+    survivor_fitness = fitness[order]
+    num_children = population.shape[0] - num_survivors
+    first = select(survivor_fitness, num_children, minimize=minimize,
+                   rng=rng)
+    second = select(survivor_fitness, num_children, minimize=minimize,
+                    rng=rng)
+    children = crossover(survivors[first], survivors[second],
+                         survivors[first, CROSS_P], rng=rng)
+    mutate_adaptive(children, tau, rng)
+    new_fitness = np.concatenate([survivor_fitness,
+                                  np.full(num_children, np.nan)])
+    return np.concatenate([survivors, children]), new_fitness
+
+
+def centered_ranks(fitness):
+    '''Replaces every value by its rank, scaled to [-0.5, 0.5], which makes
+    an update depend only on the order of the fitness values.
+    '''
+    ranks = np.empty(fitness.size)
+    ranks[fitness.ravel().argsort()] = np.arange(fitness.size)
+    if fitness.size > 1:
+        ranks /= fitness.size - 1
+    return (ranks - 0.5).reshape(fitness.shape)
@@ -0,0 +1,325 @@
+'''Theano-free inference for models saved with Serialization.save.
+
+Only NumPy is imported, so a serving process can load a model and predict
+without importing or compiling anything from Theano.
+'''
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+import json
+import os
+
+
+def expand_4d(x):
+    if x.ndim < 4:
+        return np.expand_dims(np.atleast_3d(x), axis=3)
+    else:
+        return x
+
+
+def flatten(x, ndim):
+    return x.reshape(x.shape[:ndim - 1] + (-1,))
+
+
+def softmax(x):
+    x = flatten(x, 2)
+    e_x = np.exp(x - x.max(axis=1, keepdims=True))
+    return e_x / e_x.sum(axis=1, keepdims=True)
+
+
+def alt_softmax(x):
+    return np.maximum(1e-7, softmax(x) - 1e-7)
+
+
+def log_softmax(x):
+    diff = flatten(x, 2) - flatten(x, 2).max()
+    return diff - np.log(np.exp(diff).sum())
+
+
+def binary(x):
+    return np.where(x > 0, 1e-7, 1)
+
+
+def softplus(x):
+    return np.logaddexp(0, flatten(x, 2))
+
+
+def tanh(x):
+    return np.tanh(x)
+
+
+def hard_sigmoid(x):
+    return np.clip(x * 0.2 + 0.5, 0, 1)
+
+
+def sigmoid(x):
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+
+def ReLU(x):
+    return np.maximum(x, 0) + 1e-7
+
+
+activations = {
+    'softmax': softmax,
+    'alt_softmax': alt_softmax,
+    'log_softmax': log_softmax,
+    'binary': binary,
+    'softplus': softplus,
+    'tanh': tanh,
+    'hard_sigmoid': hard_sigmoid,
+    'sigmoid': sigmoid,
+    'ReLU': ReLU,
+}
+
+
+def get_activation(value):
+    name = value['function'].rsplit('.', 1)[-1]
+    if name not in activations:
+        raise Exception('No NumPy implementation of activation ' + name)
+    return activations[name]
+
+
+def sliding_windows(x, num_rows, num_cols, row_stride, col_stride):
+    '''Returns a read-only (N, C, out_rows, out_cols, num_rows, num_cols)
+    view of every window of x without copying it.
+    '''
+    N, C, H, W = x.shape
+    out_rows = (H - num_rows) // row_stride + 1
+    out_cols = (W - num_cols) // col_stride + 1
+    s = x.strides
+    return as_strided(x, (N, C, out_rows, out_cols, num_rows, num_cols),
+                      (s[0], s[1], s[2] * row_stride, s[3] * col_stride,
+                       s[2], s[3]),
+                      writeable=False)
+
+
+def fully_connected(x, config, params, state):
+    num_examples = x.shape[0]
+    return (flatten(x, 2).dot(params[0]) + params[1]) \
+        .reshape((num_examples,) + tuple(config['nodes_shape']))
+
+
+def dropout(x, config, params, state):
+    return x
+
+
+def batch_norm(x, config, params, state):
+    output = (flatten(x, 2) - state['running_mean']) / \
+        (state['running_std'] + config['epsilon']) * params[0] + params[1]
+    return output.reshape(x.shape)
+
+
+def convolutional(x, config, params, state):
+    '''True convolution, like theano's conv2d: the filters are flipped,
+    then correlated with im2col windows through a single tensordot.
+    '''
+    filters = params[0][:, :, ::-1, ::-1]
+    num_rows, num_cols = filters.shape[2:]
+    if config['pad']:
+        x = np.pad(x, ((0, 0), (0, 0), (num_rows - 1, num_rows - 1),
+                       (num_cols - 1, num_cols - 1)), mode='constant')
+    windows = sliding_windows(x, num_rows, num_cols,
+                              config['row_stride'], config['col_stride'])
+    output = np.tensordot(windows, filters, axes=([1, 4, 5], [1, 2, 3]))
+    return output.transpose(0, 3, 1, 2)
+
+
+def max_pooling(x, config, params, state):
+    '''Max pooling with ignore_border. Theano's max_pool_2d only supports
+    padding with ignore_border, which MaxPooling disables whenever it pads,
+    so padded pooling is rejected here as well.
+    '''
+    if tuple(config['pad']) != (0, 0):
+        raise Exception('Padding works only with ignore_border=True')
+    windows = sliding_windows(x, config['pool_rows'], config['pool_cols'],
+                              config['row_stride'], config['col_stride'])
+    return windows.max(axis=(4, 5))
+
+
+def activation_layer(x, config, params, state):
+    return get_activation(config['activation'])(x)
+
+
+def prelu(x, config, params, state):
+    output = (0.5 * (1 + params[0])) * x + \
+             (0.5 * (1 + params[0])) * np.abs(x)
+    return output + 1e-7
+
+
+def simple_recurrent_step(x_t, states, params, config):
+    W, U, b = params
+    activation = get_activation(config['activation'])
+    s_t = activation((x_t.dot(W) + b) * states[0].dot(U))
+    return s_t, [s_t]
+
+
+def gru_step(x_t, states, params, config):
+    W_z, U_z, b_z, W_r, U_r, b_r, W_c, U_c, b_c = params
+    activation = get_activation(config['activation'])
+    s_t_prev = states[0]
+    z = activation(x_t.dot(W_z) + b_z + s_t_prev.dot(U_z))
+    r = activation(x_t.dot(W_r) + b_r + s_t_prev.dot(U_r))
+    c = activation(x_t.dot(W_c) + b_c + (r * s_t_prev).dot(U_c))
+    s_t = z * s_t_prev + (1 - z) * c
+    return s_t, [s_t]
+
+
+def lstm_step(x_t, states, params, config):
+    (W_i, U_i, b_i, W_f, U_f, b_f,
+     W_c, U_c, b_c, W_o, U_o, b_o) = params
+    inner_activation = get_activation(config['inner_activation'])
+    activation = get_activation(config['activation'])
+    s_t_prev, c_t_prev = states
+    i = inner_activation(x_t.dot(W_i) + b_i + s_t_prev.dot(U_i))
+    f = inner_activation(x_t.dot(W_f) + b_f + s_t_prev.dot(U_f))
+    c = f * c_t_prev + i * \
+        inner_activation(x_t.dot(W_c) + b_c + s_t_prev.dot(U_c))
+    o = inner_activation(x_t.dot(W_o) + b_o + s_t_prev.dot(U_o))
+    h = o * activation(c)
+    return h, [h, c]
+
+
+def recurrent(step, num_states):
+    def run(x, config, params, state):
+        x = flatten(x, 3)
+        num_examples, sequence_length = x.shape[:2]
+        nodes_shape = tuple(config['nodes_shape'])
+        num_nodes = int(np.prod(nodes_shape))
+        states = [np.zeros((num_examples, num_nodes), dtype='float32')
+                  for i in range(num_states)]
+        outputs = np.empty((sequence_length, num_examples, num_nodes),
+                           dtype='float32')
+        for t in range(sequence_length):
+            outputs[t], states = step(x[:, t, :], states, params, config)
+        if not config['return_sequences']:
+            return outputs[-1].reshape((num_examples,) + nodes_shape)
+        return outputs.transpose(0, 2, 1) \
+            .reshape((num_examples, sequence_length) + nodes_shape)
+    return run
+
+
+layers = {
+    'FullyConnected': fully_connected,
+    'Dropout': dropout,
+    'BatchNorm': batch_norm,
+    'Convolutional': convolutional,
+    'MaxPooling': max_pooling,
+    'ActivationLayer': activation_layer,
+    'PReLULayer': prelu,
+    'SimpleRecurrent': recurrent(simple_recurrent_step, 1),
+    'GRU': recurrent(gru_step, 1),
+    'LSTM': recurrent(lstm_step, 2),
+}
+
+
+class Engine():
+    '''Runs the Branch tree of a saved model with NumPy.
+
+    spec is the architecture spec written by Serialization.save and flat
+    the flat float32 parameter vector. The layers mirror the test-time
+    theano graphs of OkapiV2.Layers, so predict matches Model.predict to
+    float32 tolerance.
+    '''
+    def __init__(self, spec, flat):
+        index = 0
+
+        def take(shape):
+            nonlocal index
+            size = int(np.prod(shape))
+            array = flat[index:index + size].reshape(shape)
+            index += size
+            return array
+
+        self.params = []
+        for branch_spec in spec['params']:
+            self.params.append([None if layer_spec is None else
+                                [take(tuple(shape)) for shape in layer_spec]
+                                for layer_spec in branch_spec])
+        self.states = []
+        for branch_spec in spec['state']:
+            self.states.append([{name: take(tuple(shape))
+                                 for name, shape in layer_spec.items()}
+                                for layer_spec in branch_spec])
+        self.num_states = 0
+        self.tree = self.build_branch(spec['tree'])
+        self.num_output_dims = spec['num_output_dims']
+        self.output_shapes = spec.get('outputs', [])
+
+    def build_branch(self, spec):
+        branch_states = self.states[self.num_states]
+        self.num_states += 1
+        node = {'merge_mode': spec['merge_mode'], 'inputs': [],
+                'layers': []}
+        for input_spec in spec['inputs']:
+            if 'branch' in input_spec:
+                node['inputs'].append(self.build_branch(input_spec['branch']))
+            else:
+                node['inputs'].append(None)
+        for layer_spec, state in zip(spec['layers'], branch_states):
+            name = layer_spec['class'].rsplit('.', 1)[-1]
+            if name not in layers:
+                raise Exception('No NumPy implementation of layer ' + name)
+            node['layers'].append((layers[name], layer_spec['config'],
+                                   state))
+        return node
+
+    def get_output(self, node, params_list, data):
+        branch_params = params_list[0]
+        param_i = 1
+        inputs = []
+        for input in node['inputs']:
+            if input is None:
+                inputs.append(data.pop(0))
+            else:
+                inputs.append(self.get_output(input, params_list[param_i:],
+                                              data))
+                param_i += 1
+        if node['merge_mode'] != 'flat_append':
+            raise Exception('Invalid merge mode')
+        if len(inputs) > 1:
+            x = np.concatenate([flatten(input, 2) for input in inputs],
+                               axis=1)
+        else:
+            x = inputs[0]
+        for (layer, config, state), params in zip(node['layers'],
+                                                  branch_params):
+            x = layer(x, config, params, state).astype('float32', copy=False)
+        return x
+
+    def predict(self, x, batch_size=1024):
+        '''Predicts in chunks of batch_size examples, returning a list with
+        one array like Model.predict.
+        '''
+        x = [expand_4d(x_input) for x_input in x]
+        num_examples = x[0].shape[0]
+        if batch_size is None:
+            batch_size = num_examples
+        chunks = []
+        for start in range(0, num_examples, batch_size):
+            x_batch = [x_input[start:start + batch_size]
+                       .astype('float32', copy=False) for x_input in x]
+            output = self.get_output(self.tree, self.params, x_batch)
+            chunks.append(flatten(output, self.num_output_dims))
+        preds = np.concatenate(chunks)
+        if not self.output_shapes:
+            return [preds]
+        return [preds[:sum(shape)] for shape in self.output_shapes]
+
+
+def load(dirname):
+    '''Loads a model saved with Serialization.save into an Engine, mapping
+    params.npy read-only.
+    '''
+    with open(os.path.join(dirname, 'model.json')) as file:
+        spec = json.load(file)
+    flat = np.load(os.path.join(dirname, 'params.npy'), mmap_mode='r')
+    return Engine(spec, flat)
+
+
+def from_model(model):
+    '''Builds an Engine from a model in memory.'''
+    from OkapiV2 import Serialization
+    spec, arrays = Serialization.get_spec(model)
+    flat = np.concatenate([array.ravel() for array in arrays]) \
+        .astype('float32')
+    return Engine(spec, flat)
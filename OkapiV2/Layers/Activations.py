@@ -1,6 +1,6 @@
-import theano.tensor as T
+from OkapiV2.Backend import T
 from OkapiV2 import Activations, Initializers
-from OkapiV2.Layers.Basic import Layer
+from OkapiV2.Layers.Basic import Layer, split_population, merge_population
 
 
 class ActivationLayer(Layer):
@@ -9,6 +9,9 @@ class ActivationLayer(Layer):
         self.updates = None
         self.mods_io_dim = False
 
+    def get_config(self):
+        return {'activation': self.activation}
+
     def get_output_dim(self, input_shape):
         return input_shape
 
@@ -22,6 +25,9 @@ class PReLULayer(Layer):
         self.updates = None
         self.mods_io_dim = False
 
+    def get_config(self):
+        return {'initializer': self.initializer}
+
     def get_init_params(self, input_shape):
         W_shape = input_shape[1:]
         init_params = []
@@ -37,6 +43,16 @@ class PReLULayer(Layer):
                  (0.5 * (1 + params[0])) * T.abs_(input)
         return (output + 1e-7).astype('float32')
 
+    def get_population_output(self, input, params, population_size,
+                              shared_input=False, testing=True):
+        if shared_input:
+            x = input.dimshuffle(['x'] + list(range(input.ndim)))
+        else:
+            x = split_population(input, population_size)
+        W = params[0].dimshuffle([0, 'x'] + list(range(1, params[0].ndim)))
+        output = (0.5 * (1 + W)) * x + (0.5 * (1 + W)) * T.abs_(x)
+        return merge_population(output + 1e-7).astype('float32')
+
 
 '''class SoftmaxLayer(Layer):
     def __init__(self):
@@ -1,11 +1,25 @@
 from OkapiV2 import Initializers
-import theano.tensor as T
-from theano.sandbox.rng_mrg import MRG_RandomStreams as RandomStreams
-import theano
+from OkapiV2.Backend import theano, T, rng_mrg
 import numpy as np
 
 
+def split_population(x, population_size):
+    '''Reshapes (population_size * num_examples, ...) to
+    (population_size, num_examples, ...).'''
+    return x.reshape((population_size, x.shape[0] // population_size) +
+                     tuple(x.shape[i] for i in range(1, x.ndim)))
+
+
+def merge_population(x):
+    '''Reshapes (population_size, num_examples, ...) to
+    (population_size * num_examples, ...).'''
+    return x.reshape((x.shape[0] * x.shape[1],) +
+                     tuple(x.shape[i] for i in range(2, x.ndim)))
+
+
 class Layer():
+    state_names = []
+
     def __init__(self):
         raise NotImplementedError
 
@@ -21,6 +35,23 @@ class Layer():
     def get_output_dim(self, input_shape):
         return input_shape
 
+    def get_config(self):
+        raise NotImplementedError
+
+    def get_population_output(self, input, params, population_size,
+                              shared_input=False, testing=True):
+        '''Output for a whole population of parameter sets at once.
+
+        input stacks the examples of every individual as
+        (population_size * num_examples, ...), or is (num_examples, ...)
+        with shared_input while no layer with params has been applied yet.
+        Every param has a leading population axis. Layers without params
+        treat each example alike, so they just reuse get_output.
+        '''
+        if params is not None:
+            raise NotImplementedError
+        return self.get_output(input, params, testing)
+
 
 class FullyConnected(Layer):
     def __init__(self, nodes_shape=(1, 1, 1, 1),
@@ -32,6 +63,11 @@ class FullyConnected(Layer):
         self.updates = None
         self.mods_io_dim = True
 
+    def get_config(self):
+        return {'nodes_shape': self.nodes_shape,
+                'initializer': self.initializer,
+                'bias_initializer': self.bias_initializer}
+
     def get_init_params(self, input_shape):
         self.num_nodes = self.nodes_shape[0]
         for i in range(1, len(self.nodes_shape)):
@@ -63,14 +99,34 @@ class FullyConnected(Layer):
         return (input.flatten(2).dot(params[0]) + params[1]) \
             .reshape((num_examples,) + self.nodes_shape)
 
+    def get_population_output(self, input, params, population_size,
+                              shared_input=False, testing=True):
+        W, b = params
+        num_nodes = int(np.prod(self.nodes_shape))
+        if shared_input:
+            x = input.flatten(2)
+            W = W.dimshuffle(1, 0, 2).reshape(
+                (W.shape[1], population_size * num_nodes))
+            output = x.dot(W).reshape(
+                (x.shape[0], population_size, num_nodes)).dimshuffle(1, 0, 2)
+        else:
+            x = split_population(input.flatten(2), population_size)
+            output = T.batched_dot(x, W)
+        output = output + b.dimshuffle(0, 'x', 1)
+        return merge_population(output).reshape((-1,) + self.nodes_shape)
+
 
 class Dropout(Layer):
     def __init__(self, proportion=0.5):
         self.proportion = theano.shared(np.float32(proportion))
-        self.rng = RandomStreams(np.random.RandomState(12345).randint(999999))
+        self.rng = rng_mrg.MRG_RandomStreams(
+            np.random.RandomState(12345).randint(999999))
         self.updates = None
         self.mods_io_dim = False
 
+    def get_config(self):
+        return {'proportion': float(self.proportion.get_value())}
+
     def get_output_dim(self, input_shape):
         return input_shape
 
@@ -85,6 +141,8 @@ class Dropout(Layer):
 
 
 class BatchNorm(Layer):
+    state_names = ['running_mean', 'running_std']
+
     def __init__(self, norm_dim=0, momentum=0.9, epsilon=1e-7,
                  initializer=Initializers.uniform,
                  bias_initializer=Initializers.zeros):
@@ -96,6 +154,13 @@ class BatchNorm(Layer):
         self.updates = None
         self.mods_io_dim = False
 
+    def get_config(self):
+        return {'norm_dim': self.norm_dim,
+                'momentum': float(self.momentum.get_value()),
+                'epsilon': float(self.epsilon.get_value()),
+                'initializer': self.initializer,
+                'bias_initializer': self.bias_initializer}
+
     def get_init_params(self, input_shape):
         num_features = input_shape[1]
         for i in range(2, len(input_shape)):
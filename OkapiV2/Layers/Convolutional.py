@@ -1,7 +1,5 @@
-import theano.tensor as T
-from theano.tensor.signal import downsample
-from theano.sandbox.cuda import dnn
-from OkapiV2.Layers.Basic import Layer
+from OkapiV2.Backend import theano, T, downsample, dnn, dnn_available
+from OkapiV2.Layers.Basic import Layer, split_population, merge_population
 from OkapiV2 import Initializers
 
 
@@ -19,6 +17,15 @@ class Convolutional(Layer):
         self.updates = None
         self.mods_io_dim = True
 
+    def get_config(self):
+        return {'num_filters': self.num_filters,
+                'num_rows': self.num_rows,
+                'num_cols': self.num_cols,
+                'row_stride': self.row_stride,
+                'col_stride': self.col_stride,
+                'pad': self.pad,
+                'initializer': self.initializer}
+
     def get_init_params(self, input_shape):
         f_shape = (self.num_filters, input_shape[1],
                    self.num_rows, self.num_cols)
@@ -56,7 +63,7 @@ class Convolutional(Layer):
         return self.output_dim
 
     def get_output(self, input, params, testing=False):
-        if dnn.dnn_available():
+        if dnn_available():
             return dnn.dnn_conv(img=input,
                                 kerns=params[0],
                                 subsample=(self.row_stride, self.col_stride),
@@ -67,6 +74,56 @@ class Convolutional(Layer):
                                  subsample=(self.row_stride, self.col_stride),
                                  border_mode=self.conv_mode)
 
+    def get_population_output(self, input, params, population_size,
+                              shared_input=False, testing=True):
+        '''With shared_input the filters of every individual are stacked
+        into one bank and applied in a single convolution. Otherwise each
+        individual's filters only see its own examples, which is a grouped
+        convolution with one group per individual.
+        '''
+        filters = params[0]
+        if not shared_input:
+            x = split_population(input, population_size)
+            return merge_population(
+                self.get_grouped_output(x, filters, population_size))
+        kerns = filters.reshape((population_size * self.num_filters,
+                                 filters.shape[2], self.num_rows,
+                                 self.num_cols))
+        output = self.get_output(input, [kerns], testing)
+        output = output.reshape((output.shape[0], population_size,
+                                 self.num_filters, output.shape[2],
+                                 output.shape[3]))
+        return merge_population(output.dimshuffle(1, 0, 2, 3, 4))
+
+    def get_grouped_output(self, x, filters, population_size):
+        '''Convolves x of shape (population_size, num_examples, ...) with
+        filters of shape (population_size, num_filters, ...) group-wise.
+        conv2d only takes num_groups from Theano 0.10 on, so older versions
+        convolve one individual at a time in a scan.
+        '''
+        num_examples = x.shape[1]
+        num_channels = filters.shape[2]
+        try:
+            output = T.nnet.conv2d(
+                x.dimshuffle(1, 0, 2, 3, 4).reshape(
+                    (num_examples, population_size * num_channels,
+                     x.shape[3], x.shape[4])),
+                filters.reshape((population_size * self.num_filters,
+                                 num_channels, self.num_rows,
+                                 self.num_cols)),
+                subsample=(self.row_stride, self.col_stride),
+                border_mode=self.conv_mode,
+                num_groups=population_size)
+        except TypeError:
+            output, updates = theano.map(
+                lambda x_i, filters_i: self.get_output(x_i, [filters_i]),
+                sequences=[x, filters])
+            return output
+        output = output.reshape((num_examples, population_size,
+                                 self.num_filters, output.shape[2],
+                                 output.shape[3]))
+        return output.dimshuffle(1, 0, 2, 3, 4)
+
 
 class MaxPooling(Layer):
     def __init__(self, pool_rows=1, pool_cols=1, row_stride=1, col_stride=1,
@@ -83,6 +140,13 @@ class MaxPooling(Layer):
         self.updates = None
         self.mods_io_dim = True
 
+    def get_config(self):
+        return {'pool_rows': self.pool_rows,
+                'pool_cols': self.pool_cols,
+                'row_stride': self.row_stride,
+                'col_stride': self.col_stride,
+                'pad': self.pad}
+
     def set_final_output_shape(self, output_shape):
         return
 
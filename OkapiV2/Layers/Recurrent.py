@@ -1,5 +1,4 @@
-import theano
-import theano.tensor as T
+from OkapiV2.Backend import theano, T
 from OkapiV2 import Activations, Initializers
 from OkapiV2.Layers.Basic import Layer
 
@@ -8,6 +7,14 @@ class RecurrentLayer(Layer):
     def __init__(self):
         raise NotImplementedError
 
+    def get_config(self):
+        return {'nodes_shape': self.nodes_shape,
+                'activation': self.activation,
+                'return_sequences': self.return_sequences,
+                'initializer': self.initializer,
+                'inner_initializer': self.inner_initializer,
+                'bias_initializer': self.bias_initializer}
+
     def get_init_params(self, input_shape):
         self.num_nodes = self.nodes_shape[0]
         for i in range(1, len(self.nodes_shape)):
@@ -27,6 +34,9 @@ class RecurrentLayer(Layer):
         self.nodes_shape = tuple(output_shape[1:])
 
     def get_output_dim(self, input_shape):
+        self.num_nodes = self.nodes_shape[0]
+        for i in range(1, len(self.nodes_shape)):
+            self.num_nodes *= self.nodes_shape[i]
         if not self.return_sequences:
             self.output_dim = (input_shape[0],) + self.nodes_shape
         else:
@@ -186,6 +196,12 @@ class LSTM(RecurrentLayer):
         self.updates = None
         self.mods_io_dim = True
 
+    def get_config(self):
+        config = super().get_config()
+        config['inner_activation'] = self.inner_activation
+        config['forget_initializer'] = self.forget_initializer
+        return config
+
     def get_init_params_list(self, num_features, num_nodes):
         W_i_shape = (num_features,) + (num_nodes,)
         U_i_shape = (num_nodes,) + (num_nodes,)
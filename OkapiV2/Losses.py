@@ -1,5 +1,4 @@
-import theano
-import theano.tensor as T
+from OkapiV2.Backend import theano, T
 import numpy as np
 
 
@@ -7,11 +6,17 @@ class Regularizer():
     def __init__(self):
         return
 
+    def get_config(self):
+        return {}
+
 
 class L1Reg(Regularizer):
     def __init__(self, param=0.0):
         self.param = param
 
+    def get_config(self):
+        return {'param': self.param}
+
     def get_reg_term(self, params_list, num_examples):
         l1_term = 0
         for params in params_list:
@@ -23,6 +28,9 @@ class L2Reg(Regularizer):
     def __init__(self, param=0.0):
         self.param = param
 
+    def get_config(self):
+        return {'param': self.param}
+
     def get_reg_term(self, params_list, num_examples):
         l2_term = 0
         for params in params_list:
@@ -34,6 +42,9 @@ class Loss():
     def __init__(self, regularizer=None):
         self.regularizer = regularizer
 
+    def get_config(self):
+        return {'regularizer': self.regularizer}
+
 
 class Crossentropy(Loss):
     def get_train_loss(self, y_hat, y, params_list):
@@ -51,6 +62,10 @@ class Crossentropy(Loss):
         return T.nnet.categorical_crossentropy(
             y_hat.flatten(2), y.flatten(2)).mean()
 
+    def get_example_losses(self, y_hat, y):
+        return T.nnet.categorical_crossentropy(y_hat.flatten(2),
+                                               y.flatten(2))
+
 
 class MeanSquared(Loss):
     def get_train_loss(self, y_hat, y, params_list):
@@ -63,6 +78,9 @@ class MeanSquared(Loss):
     def get_test_loss(self, y_hat, y, params_list):
         return T.mean(T.pow((y.flatten(2) - y_hat.flatten(2)), 2))
 
+    def get_example_losses(self, y_hat, y):
+        return T.mean(T.pow((y.flatten(2) - y_hat.flatten(2)), 2), axis=1)
+
 
 '''class SoftmaxCrossentropy(Loss):
     def __init__(self, l1_param=0.00, l2_param=0.00):
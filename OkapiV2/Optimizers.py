@@ -1,5 +1,4 @@
-import theano
-import theano.tensor as T
+from OkapiV2.Backend import theano, T
 import numpy as np
 
 
@@ -10,6 +9,13 @@ class Optimizer():
     def build(self, all_params):
         return
 
+    def get_updates(self, params_list, loss):
+        grads = [T.grad(loss, params) for params in params_list]
+        return self.get_grad_updates(params_list, grads)
+
+    def get_num_vec_states(self):
+        return 0
+
 
 class RMSprop(Optimizer):
     def __init__(self, learning_rate=0.001, momentum=0.99,
@@ -25,10 +31,10 @@ class RMSprop(Optimizer):
                 theano.shared(np.zeros(params.get_value().shape)
                               .astype('float32')))
 
-    def get_updates(self, params_list, loss):
+    def get_grad_updates(self, params_list, grads):
         self.updates = []
-        for params, accumulator in zip(params_list, self.accumulators):
-            grad = T.grad(loss, params)
+        for params, grad, accumulator in zip(params_list, grads,
+                                             self.accumulators):
             accumulator_update = self.momentum * accumulator + \
                 (1 - self.momentum) * grad ** 2
             self.updates.append((accumulator, accumulator_update))
@@ -37,15 +43,29 @@ class RMSprop(Optimizer):
             self.updates.append((params, new_params))
         return self.updates
 
+    def get_num_vec_states(self):
+        return 1
+
+    def apply_vec_update(self, params_vec, grad_vec, states):
+        '''Updates a flat parameter vector in place with NumPy.'''
+        momentum = self.momentum.get_value()
+        accumulator = states[0]
+        accumulator *= momentum
+        accumulator += (1 - momentum) * grad_vec ** 2
+        params_vec -= self.learning_rate.get_value() * grad_vec / \
+            np.sqrt(accumulator + self.epsilon.get_value())
+
 
 class SGD(Optimizer):
     def __init__(self, learning_rate=0.001):
         self.learning_rate = theano.shared(np.float32(learning_rate))
 
-    def get_updates(self, params_list, loss):
+    def get_grad_updates(self, params_list, grads):
         self.updates = []
-        for params in params_list:
-            grad = T.grad(loss, params)
+        for params, grad in zip(params_list, grads):
             new_params = params - self.learning_rate * grad
             self.updates.append((params, new_params))
         return self.updates
+
+    def apply_vec_update(self, params_vec, grad_vec, states):
+        params_vec -= self.learning_rate.get_value() * grad_vec
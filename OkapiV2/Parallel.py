@@ -0,0 +1,773 @@
+from OkapiV2.Core import BatchIterator, atleast_4d, expand_4d
+from OkapiV2 import Callbacks, Evolution, Optimizers, Telemetry
+from numpy.lib.stride_tricks import as_strided
+import multiprocessing
+import threading
+import traceback
+import numpy as np
+import time
+
+
+def shared_array(shape, dtype='float32'):
+    '''Allocates a zeroed array in memory shared with forked processes.'''
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buffer = multiprocessing.RawArray('b', max(size * dtype.itemsize, 1))
+    return np.frombuffer(buffer, dtype=dtype, count=size).reshape(shape)
+
+
+class DataParallelTrainer():
+    '''Synchronous data-parallel training across forked worker processes.
+
+    Every worker holds a replica of the compiled model and computes the
+    gradient of its shard of each batch. The shard gradients are summed in
+    shared memory, each worker reducing one slice of the parameter vector,
+    after which the master applies a single optimizer update and broadcasts
+    the new parameter vector to the workers.
+    '''
+    def __init__(self, model, num_workers=4):
+        self.model = model
+        self.num_workers = num_workers
+        self.workers = []
+
+    def start(self, x, y, batch_size):
+        self.model.get_function('grad_vec')
+        self.model.get_function('apply_grad_vec')
+        params = self.model.get_params_as_vec()
+        num_params = params.shape[0]
+        context = multiprocessing.get_context('fork')
+        self.params = shared_array((num_params,))
+        self.params[:] = params
+        self.grads = shared_array((self.num_workers, num_params))
+        self.grad_sum = shared_array((num_params,))
+        self.losses = shared_array((self.num_workers,), 'float64')
+        self.indices = shared_array((batch_size,), 'int32')
+        self.batch_len = context.RawValue('i', 0)
+        self.running = context.RawValue('b', 1)
+        self.start_barrier = context.Barrier(self.num_workers + 1)
+        self.reduce_barrier = context.Barrier(self.num_workers)
+        self.done_barrier = context.Barrier(self.num_workers + 1)
+        for worker_id in range(self.num_workers):
+            worker = context.Process(target=self.work,
+                                     args=(worker_id, x, y))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def work(self, worker_id, x, y):
+        try:
+            self.work_loop(worker_id, x, y)
+        except Exception:
+            traceback.print_exc()
+            for barrier in (self.start_barrier, self.reduce_barrier,
+                            self.done_barrier):
+                barrier.abort()
+
+    def work_loop(self, worker_id, x, y):
+        grad_step = self.model.get_function('grad_vec')
+        num_params = self.params.shape[0]
+        reduce_start = num_params * worker_id // self.num_workers
+        reduce_stop = num_params * (worker_id + 1) // self.num_workers
+        while True:
+            self.start_barrier.wait()
+            if not self.running.value:
+                return
+            self.model.set_params_as_vec(self.params)
+            batch_len = self.batch_len.value
+            shard_start = batch_len * worker_id // self.num_workers
+            shard_stop = batch_len * (worker_id + 1) // self.num_workers
+            shard_len = shard_stop - shard_start
+            if shard_len > 0:
+                indices = self.indices[shard_start:shard_stop]
+                x_shard = [atleast_4d(np.take(x_input, indices, axis=0))
+                           for x_input in x]
+                y_shard = atleast_4d(np.take(y, indices, axis=0))
+                loss, grad = grad_step(*x_shard, y_shard)
+                np.multiply(grad, shard_len, out=self.grads[worker_id])
+                self.losses[worker_id] = loss * shard_len
+            else:
+                self.grads[worker_id] = 0
+                self.losses[worker_id] = 0
+            self.reduce_barrier.wait()
+            self.grads[:, reduce_start:reduce_stop].sum(
+                axis=0, out=self.grad_sum[reduce_start:reduce_stop])
+            self.done_barrier.wait()
+
+    def step(self, indices):
+        batch_len = len(indices)
+        self.indices[:batch_len] = indices
+        self.batch_len.value = batch_len
+        self.start_barrier.wait()
+        self.done_barrier.wait()
+        self.model.apply_grad_vec(self.grad_sum / batch_len)
+        self.params[:] = self.model.get_params_as_vec()
+        return self.losses.sum() / batch_len
+
+    def stop(self):
+        self.running.value = 0
+        try:
+            self.start_barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def train(self, x, y, num_epochs=12, batch_size=128, shuffle=True,
+              callbacks=None, verbose=True):
+        '''Trains like Model.train, callbacks and verbose working the
+        same way. The callbacks see the master model, whose params are
+        updated after every step. Returns the Telemetry.EpochStats of
+        every epoch.
+        '''
+        x = [expand_4d(x_input) for x_input in x]
+        y = expand_4d(y)
+        if not self.model.compiled:
+            self.model.compile(x, y)
+        batches = BatchIterator(x, y, batch_size, shuffle, num_buffers=0)
+        num_batches = len(batches)
+        callbacks = Callbacks.get_callback_list(callbacks, self.model,
+                                                verbose)
+        telemetry = Telemetry.Telemetry(num_batches)
+        logs = {'num_epochs': num_epochs, 'num_batches': num_batches,
+                'loss': None, 'metrics': None, 'stats': None,
+                'telemetry': telemetry}
+        self.model.stop_training = False
+        self.start(x, y, batch_size)
+        if verbose:
+            print('Started training on {} workers...'
+                  .format(self.num_workers))
+        try:
+            callbacks.on_train_begin(logs)
+            for epoch in range(num_epochs):
+                callbacks.on_epoch_begin(epoch, logs)
+                telemetry.begin_epoch(epoch)
+                total_loss = 0
+                for batch_num, indices in enumerate(batches.iter_indices()):
+                    telemetry.mark_data()
+                    loss = self.step(indices)
+                    telemetry.mark_step(len(indices))
+                    total_loss += loss
+                    logs['loss'] = loss
+                    callbacks.on_batch_end(epoch, batch_num, logs)
+                    telemetry.mark_report()
+                    if self.model.stop_training:
+                        break
+                avg_loss = total_loss / max(telemetry.batch_num, 1)
+                logs['stats'] = telemetry.end_epoch(avg_loss)
+                callbacks.on_epoch_end(epoch, logs)
+                if self.model.stop_training:
+                    break
+        finally:
+            self.stop()
+        callbacks.on_train_end(logs)
+        return telemetry.history
+
+
+class HogwildTrainer():
+    '''Lock-free asynchronous SGD over one shared parameter buffer.
+
+    The parameters and the optimizer state live in shared memory. Each
+    forked worker rebinds its model's shared variables to views of the
+    parameter buffer, trains on its own shard of the examples and applies
+    the optimizer's apply_vec_update to the buffer in place without
+    locking. Suited to small or sparse models where updates rarely collide.
+    '''
+    def __init__(self, model, num_workers=4, poll_seconds=0.1):
+        self.model = model
+        self.num_workers = num_workers
+        self.poll_seconds = poll_seconds
+
+    def work(self, worker_id, x, y, num_epochs, batch_size, seed):
+        self.model.bind_params_buffer(self.params, copy=False)
+        grad_step = self.model.get_function('grad_vec')
+        optimizer = self.model.optimizer
+        rng = np.random.RandomState(seed + worker_id)
+        shard = np.arange(worker_id, y.shape[0], self.num_workers,
+                          dtype='int32')
+        for epoch in range(num_epochs):
+            rng.shuffle(shard)
+            for start in range(0, shard.shape[0], batch_size):
+                if not self.running.value:
+                    return
+                indices = np.sort(shard[start:start + batch_size])
+                x_batch = [atleast_4d(np.take(x_input, indices, axis=0))
+                           for x_input in x]
+                y_batch = atleast_4d(np.take(y, indices, axis=0))
+                loss, grad = grad_step(*x_batch, y_batch)
+                optimizer.apply_vec_update(self.params, grad, self.states)
+                self.losses[worker_id, epoch] += loss
+                self.batches_done[worker_id] += 1
+
+    def train(self, x, y, num_epochs=12, batch_size=128, seed=1234,
+              callbacks=None, verbose=True):
+        '''Trains like Model.train, callbacks and verbose working the
+        same way. The master polls the workers every poll_seconds and
+        reports the batches finished since as one on_batch_end, an epoch
+        ending once the workers have run as many batches as there are in
+        one pass over the examples. The master model is bound to the
+        shared parameter buffer while training, so the callbacks see the
+        live params. Returns the Telemetry.EpochStats of every epoch.
+        '''
+        x = [expand_4d(x_input) for x_input in x]
+        y = expand_4d(y)
+        if not self.model.compiled:
+            self.model.compile(x, y)
+        self.model.get_function('grad_vec')
+        params = self.model.get_params_as_vec()
+        self.params = shared_array(params.shape)
+        self.params[:] = params
+        num_states = self.model.optimizer.get_num_vec_states()
+        self.states = shared_array((num_states,) + params.shape)
+        self.losses = shared_array((self.num_workers, num_epochs), 'float64')
+        self.batches_done = shared_array((self.num_workers,), 'int64')
+        context = multiprocessing.get_context('fork')
+        self.running = context.RawValue('b', 1)
+
+        num_examples = y.shape[0]
+        num_batches = sum(-(-len(range(worker_id, num_examples,
+                                       self.num_workers)) // batch_size)
+                          for worker_id in range(self.num_workers))
+        callbacks = Callbacks.get_callback_list(callbacks, self.model,
+                                                verbose)
+        telemetry = Telemetry.Telemetry(num_batches)
+        logs = {'num_epochs': num_epochs, 'num_batches': num_batches,
+                'loss': None, 'metrics': None, 'stats': None,
+                'telemetry': telemetry}
+        self.model.stop_training = False
+        self.model.bind_params_buffer(self.params, copy=False)
+        workers = []
+        for worker_id in range(self.num_workers):
+            worker = context.Process(
+                target=self.work,
+                args=(worker_id, x, y, num_epochs, batch_size, seed))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        if verbose:
+            print('Started training on {} workers...'
+                  .format(self.num_workers))
+
+        def examples_before(batch):
+            return num_examples * batch // num_batches
+
+        try:
+            callbacks.on_train_begin(logs)
+            callbacks.on_epoch_begin(0, logs)
+            telemetry.begin_epoch(0)
+            epoch, seen = 0, 0
+            while epoch < num_epochs and not self.model.stop_training:
+                time.sleep(self.poll_seconds)
+                alive = any(worker.is_alive() for worker in workers)
+                done = int(self.batches_done.sum())
+                while seen < done and epoch < num_epochs:
+                    epoch_start = epoch * num_batches
+                    new_seen = min(done, epoch_start + num_batches)
+                    telemetry.mark_batches(
+                        new_seen - seen,
+                        examples_before(new_seen - epoch_start) -
+                        examples_before(seen - epoch_start))
+                    seen = new_seen
+                    batch_num = seen - epoch_start
+                    logs['loss'] = self.losses[:, epoch].sum() / batch_num
+                    callbacks.on_batch_end(epoch, batch_num - 1, logs)
+                    telemetry.mark_report()
+                    if batch_num == num_batches or \
+                            self.model.stop_training:
+                        logs['stats'] = telemetry.end_epoch(logs['loss'])
+                        callbacks.on_epoch_end(epoch, logs)
+                        epoch += 1
+                        if epoch == num_epochs or self.model.stop_training:
+                            break
+                        callbacks.on_epoch_begin(epoch, logs)
+                        telemetry.begin_epoch(epoch)
+                if not alive:
+                    break
+        finally:
+            self.running.value = 0
+            for worker in workers:
+                worker.join()
+            self.model.bind_params_buffer()
+        for worker in workers:
+            if worker.exitcode != 0:
+                raise Exception('Hogwild worker exited with code {}'
+                                .format(worker.exitcode))
+        callbacks.on_train_end(logs)
+        return telemetry.history
+
+
+def shared_copy(array, dtype='float32'):
+    '''Copies array into memory shared with forked processes.'''
+    copy = shared_array(array.shape, dtype)
+    copy[...] = array
+    return copy
+
+
+def mean_test_loss(model, x, y, batch_size=1024):
+    '''Test loss over x and y, weighted by batch size.'''
+    loss = 0
+    for start in range(0, y.shape[0], batch_size):
+        x_batch = [x_input[start:start + batch_size] for x_input in x]
+        y_batch = y[start:start + batch_size]
+        loss += model.get_test_loss(x_batch, y_batch) * y_batch.shape[0]
+    return loss / y.shape[0]
+
+
+class PopulationEvaluator():
+    '''Evaluates every row of a population matrix across persistent forked
+    worker processes.
+
+    The population and the fitness values live in shared memory, while x
+    and y are inherited unchanged by the forked workers. Each worker keeps
+    a replica of the compiled model and claims the next individual from a
+    shared counter until none are left, loading its genome with
+    set_params_as_vec and writing fitness(model, x, y) into the shared
+    fitness array, so neither genomes nor results are pickled. fitness
+    defaults to the test loss. Genomes may carry extra genes after the
+    params, which are ignored.
+    '''
+    def __init__(self, model, x, y, num_workers=4, fitness=None,
+                 batch_size=1024):
+        self.model = model
+        self.x = [expand_4d(x_input) for x_input in x]
+        self.y = expand_4d(y)
+        self.num_workers = num_workers
+        if fitness is None:
+            def fitness(model, x, y):
+                return mean_test_loss(model, x, y, batch_size)
+        self.fitness_function = fitness
+        self.workers = []
+
+    def start(self, population_size, genome_size):
+        if not self.model.compiled:
+            self.model.compile(self.x, self.y)
+        self.model.get_function('test_loss')
+        self.num_params = self.model.get_params_as_vec().shape[0]
+        if genome_size < self.num_params:
+            raise Exception('Genomes have {} genes but the model has {} '
+                            'params'.format(genome_size, self.num_params))
+        context = multiprocessing.get_context('fork')
+        self.population = shared_array((population_size, genome_size))
+        self.fitness = shared_array((population_size,), 'float64')
+        self.population_size = context.RawValue('i', 0)
+        self.next_index = context.Value('i', 0)
+        self.running = context.RawValue('b', 1)
+        self.start_barrier = context.Barrier(self.num_workers + 1)
+        self.done_barrier = context.Barrier(self.num_workers + 1)
+        for worker_id in range(self.num_workers):
+            worker = context.Process(target=self.work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def work(self):
+        try:
+            self.work_loop()
+        except Exception:
+            traceback.print_exc()
+            self.start_barrier.abort()
+            self.done_barrier.abort()
+
+    def claim(self):
+        with self.next_index.get_lock():
+            index = self.next_index.value
+            self.next_index.value += 1
+        return index
+
+    def work_loop(self):
+        while True:
+            self.start_barrier.wait()
+            if not self.running.value:
+                return
+            index = self.claim()
+            while index < self.population_size.value:
+                self.model.set_params_as_vec(
+                    self.population[index, :self.num_params])
+                self.fitness[index] = self.fitness_function(
+                    self.model, self.x, self.y)
+                index = self.claim()
+            self.done_barrier.wait()
+
+    def evaluate(self, population):
+        '''Returns the fitness of every row of population.'''
+        population_size, genome_size = population.shape
+        if self.workers and (population_size > self.population.shape[0] or
+                             genome_size != self.population.shape[1]):
+            self.stop()
+        if not self.workers:
+            self.start(population_size, genome_size)
+        self.population[:population_size] = population
+        self.population_size.value = population_size
+        self.next_index.value = 0
+        try:
+            self.start_barrier.wait()
+            self.done_barrier.wait()
+        except threading.BrokenBarrierError:
+            self.stop()
+            raise Exception('A population evaluator worker failed')
+        return self.fitness[:population_size].copy()
+
+    def stop(self):
+        self.running.value = 0
+        try:
+            self.start_barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+
+class NoiseTable():
+    '''A fixed block of standard normal noise in shared memory.
+
+    A perturbation is the slice of the table at some offset, so processes
+    forked after the table is built exchange offsets instead of vectors.
+    The table is filled from seed in chunks, so the same seed and size
+    always give the same noise.
+    '''
+    def __init__(self, size=25000000, seed=123):
+        self.noise = shared_array((size,))
+        rng = np.random.RandomState(seed)
+        chunk_size = 1 << 20
+        for start in range(0, size, chunk_size):
+            stop = min(start + chunk_size, size)
+            self.noise[start:stop] = rng.standard_normal(stop - start)
+
+    def get(self, offset, dim):
+        return self.noise[offset:offset + dim]
+
+    def sample_offsets(self, dim, num_offsets, rng=np.random):
+        if dim > self.noise.shape[0]:
+            raise Exception('Noise table of {} values is too small for {} '
+                            'params'.format(self.noise.shape[0], dim))
+        return rng.randint(0, self.noise.shape[0] - dim + 1, num_offsets)
+
+    def weighted_sum(self, weights, offsets, dim, chunk_size=64):
+        '''Returns the sum of the slices at offsets weighted by weights.'''
+        itemsize = self.noise.itemsize
+        windows = as_strided(self.noise,
+                             (self.noise.shape[0] - dim + 1, dim),
+                             (itemsize, itemsize), writeable=False)
+        weights = weights.astype('float32')
+        total = np.zeros(dim, dtype='float32')
+        for start in range(0, offsets.shape[0], chunk_size):
+            stop = start + chunk_size
+            total += weights[start:stop].dot(windows[offsets[start:stop]])
+        return total
+
+
+class ESTrainer():
+    '''Trains the flat parameter vector with evolution strategies.
+
+    Every step samples num_pairs noise offsets and the workers, each with
+    its own replica of the compiled model, claim pairs from a shared
+    counter and score the antithetic params + sigma * noise and
+    params - sigma * noise on the same batch with fitness, the test loss
+    by default (lower is better). Only the offsets, the batch indices and
+    the scalar losses pass through shared memory, the noise itself being
+    read from a shared NoiseTable. The losses are replaced by their
+    centered ranks and the noise weighted by the rank difference of each
+    pair is the gradient estimate, sigma being folded into the learning
+    rate, which optimizer applies with its apply_vec_update along with
+    l2_coeff weight decay.
+    '''
+    def __init__(self, model, num_workers=4, num_pairs=50, sigma=0.02,
+                 optimizer=None, l2_coeff=0.005, noise_table=None,
+                 fitness=None):
+        self.model = model
+        self.num_workers = num_workers
+        self.num_pairs = num_pairs
+        self.sigma = sigma
+        if optimizer is None:
+            optimizer = Optimizers.RMSprop(learning_rate=0.01)
+        self.optimizer = optimizer
+        self.l2_coeff = l2_coeff
+        self.noise_table = noise_table
+        if fitness is None:
+            def fitness(model, x, y):
+                return model.get_test_loss(x, y)
+        self.fitness_function = fitness
+        self.workers = []
+
+    def start(self, x, y, batch_size):
+        self.model.get_function('test_loss')
+        if self.noise_table is None:
+            self.noise_table = NoiseTable()
+        params = self.model.get_params_as_vec()
+        context = multiprocessing.get_context('fork')
+        self.params = shared_array(params.shape)
+        self.params[:] = params
+        num_states = self.optimizer.get_num_vec_states()
+        self.states = np.zeros((num_states,) + params.shape,
+                               dtype='float32')
+        self.offsets = shared_array((self.num_pairs,), 'int64')
+        self.returns = shared_array((self.num_pairs, 2), 'float64')
+        self.indices = shared_array((batch_size,), 'int32')
+        self.batch_len = context.RawValue('i', 0)
+        self.next_index = context.Value('i', 0)
+        self.running = context.RawValue('b', 1)
+        self.start_barrier = context.Barrier(self.num_workers + 1)
+        self.done_barrier = context.Barrier(self.num_workers + 1)
+        for worker_id in range(self.num_workers):
+            worker = context.Process(target=self.work, args=(x, y))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def work(self, x, y):
+        try:
+            self.work_loop(x, y)
+        except Exception:
+            traceback.print_exc()
+            self.start_barrier.abort()
+            self.done_barrier.abort()
+
+    def claim(self):
+        with self.next_index.get_lock():
+            index = self.next_index.value
+            self.next_index.value += 1
+        return index
+
+    def work_loop(self, x, y):
+        num_params = self.params.shape[0]
+        while True:
+            self.start_barrier.wait()
+            if not self.running.value:
+                return
+            indices = self.indices[:self.batch_len.value]
+            x_batch = [atleast_4d(np.take(x_input, indices, axis=0))
+                       for x_input in x]
+            y_batch = atleast_4d(np.take(y, indices, axis=0))
+            index = self.claim()
+            while index < self.num_pairs:
+                noise = self.noise_table.get(self.offsets[index], num_params)
+                for i, sign in enumerate((1, -1)):
+                    self.model.sync_params_buffer(copy=False)
+                    perturbed = self.model.params_buffer
+                    np.multiply(noise, sign * self.sigma, out=perturbed)
+                    perturbed += self.params
+                    self.returns[index, i] = self.fitness_function(
+                        self.model, x_batch[:], y_batch)
+                index = self.claim()
+            self.done_barrier.wait()
+
+    def step(self, indices, rng=np.random):
+        '''Runs one generation on the batch at indices and returns the mean
+        loss of the perturbed params.'''
+        num_params = self.params.shape[0]
+        batch_len = len(indices)
+        self.indices[:batch_len] = indices
+        self.batch_len.value = batch_len
+        self.offsets[:] = self.noise_table.sample_offsets(
+            num_params, self.num_pairs, rng)
+        self.next_index.value = 0
+        try:
+            self.start_barrier.wait()
+            self.done_barrier.wait()
+        except threading.BrokenBarrierError:
+            self.stop()
+            raise Exception('An ES worker failed')
+        ranks = Evolution.centered_ranks(self.returns)
+        grad = self.noise_table.weighted_sum(ranks[:, 0] - ranks[:, 1],
+                                             self.offsets, num_params)
+        grad /= self.returns.size
+        grad += self.l2_coeff * self.params
+        self.optimizer.apply_vec_update(self.params, grad, self.states)
+        return self.returns.mean()
+
+    def stop(self):
+        self.running.value = 0
+        try:
+            self.start_barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def train(self, x, y, num_epochs=1, batch_size=128, shuffle=True,
+              seed=1234, callbacks=None, verbose=True):
+        '''Trains like Model.train, callbacks and verbose working the
+        same way. The master model's params are set to the updated
+        parameter vector after every step, so the callbacks see them.
+        Returns the Telemetry.EpochStats of every epoch.
+        '''
+        x = [expand_4d(x_input) for x_input in x]
+        y = expand_4d(y)
+        if not self.model.compiled:
+            self.model.compile(x, y)
+        batches = BatchIterator(x, y, batch_size, shuffle, num_buffers=0)
+        num_batches = len(batches)
+        rng = np.random.RandomState(seed)
+        callbacks = Callbacks.get_callback_list(callbacks, self.model,
+                                                verbose)
+        telemetry = Telemetry.Telemetry(num_batches)
+        logs = {'num_epochs': num_epochs, 'num_batches': num_batches,
+                'loss': None, 'metrics': None, 'stats': None,
+                'telemetry': telemetry}
+        self.model.stop_training = False
+        self.start(x, y, batch_size)
+        if verbose:
+            print('Started ES on {} workers...'.format(self.num_workers))
+        try:
+            callbacks.on_train_begin(logs)
+            for epoch in range(num_epochs):
+                callbacks.on_epoch_begin(epoch, logs)
+                telemetry.begin_epoch(epoch)
+                total_loss = 0
+                for batch_num, indices in enumerate(batches.iter_indices()):
+                    telemetry.mark_data()
+                    loss = self.step(indices, rng)
+                    self.model.set_params_as_vec(self.params)
+                    telemetry.mark_step(len(indices))
+                    total_loss += loss
+                    logs['loss'] = loss
+                    callbacks.on_batch_end(epoch, batch_num, logs)
+                    telemetry.mark_report()
+                    if self.model.stop_training:
+                        break
+                avg_loss = total_loss / max(telemetry.batch_num, 1)
+                logs['stats'] = telemetry.end_epoch(avg_loss)
+                callbacks.on_epoch_end(epoch, logs)
+                if self.model.stop_training:
+                    break
+        finally:
+            self.stop()
+            self.model.set_params_as_vec(self.params)
+        callbacks.on_train_end(logs)
+        return telemetry.history
+
+
+class IslandGA():
+    '''Evolves num_islands subpopulations in parallel forked processes.
+
+    Each island runs Evolution.next_generation on its own slice of the
+    population with its own replica of the compiled model, evaluating its
+    children with evaluate(model, genomes), by default the population loss
+    on x and y. Every migration_interval generations an island writes its
+    num_migrants fittest genomes and their fitness into its slot of a
+    shared-memory ring and replaces its worst genomes with the newest
+    migrants in the previous island's slot. Slots are versioned and guarded
+    by their own lock, so islands never wait for each other, and migrants
+    that were already taken are not taken twice. Genomes must carry the
+    self-adaptive rate genes.
+    '''
+    def __init__(self, model, x, y, num_islands=4, migration_interval=5,
+                 num_migrants=2, rm_p=0.8, batch_size=100, evaluate=None):
+        self.model = model
+        self.num_islands = num_islands
+        self.migration_interval = migration_interval
+        self.num_migrants = num_migrants
+        self.rm_p = rm_p
+        self.default_evaluate = evaluate is None
+        if evaluate is None:
+            x = [expand_4d(x_input) for x_input in x]
+            y = expand_4d(y)
+
+            def evaluate(model, genomes):
+                return model.get_population_loss(
+                    genomes[:, :-Evolution.NUM_RATE_GENES], x[:], y,
+                    batch_size)
+        self.evaluate_function = evaluate
+
+    def start(self, population, num_generations, seed):
+        population_size, genome_size = population.shape
+        self.bounds = [population_size * island_id // self.num_islands
+                       for island_id in range(self.num_islands + 1)]
+        island_sizes = np.diff(self.bounds)
+        self.num_survivors = [size - int(round(self.rm_p * size))
+                              for size in island_sizes]
+        if not self.num_migrants < min(self.num_survivors):
+            raise Exception('num_migrants must be below the {} survivors of '
+                            'each island'.format(min(self.num_survivors)))
+        if self.default_evaluate:
+            self.model.set_population(
+                population[:1, :-Evolution.NUM_RATE_GENES])
+            for size, num_survivors in set(zip(island_sizes,
+                                               self.num_survivors)):
+                self.model.get_function('population_loss', int(size))
+                self.model.get_function('population_loss',
+                                        int(size - num_survivors))
+        context = multiprocessing.get_context('fork')
+        self.population = shared_copy(population)
+        self.fitness = shared_array((population_size,), 'float64')
+        self.migrants = shared_array((self.num_islands, self.num_migrants,
+                                      genome_size))
+        self.migrant_fitness = shared_array(
+            (self.num_islands, self.num_migrants), 'float64')
+        self.versions = shared_array((self.num_islands,), 'int64')
+        self.locks = [context.Lock() for i in range(self.num_islands)]
+        self.history = shared_array((self.num_islands, num_generations),
+                                    'float64')
+        self.history[:] = np.nan
+        self.generations_done = shared_array((self.num_islands,), 'int64')
+        self.workers = []
+        for island_id in range(self.num_islands):
+            worker = context.Process(
+                target=self.work, args=(island_id, num_generations, seed))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def emigrate(self, island_id, population, fitness):
+        best = np.argsort(fitness)[:self.num_migrants]
+        with self.locks[island_id]:
+            self.migrants[island_id] = population[best]
+            self.migrant_fitness[island_id] = fitness[best]
+            self.versions[island_id] += 1
+
+    def immigrate(self, source, population, fitness, last_version):
+        worst = np.argsort(fitness)[-self.num_migrants:]
+        with self.locks[source]:
+            version = self.versions[source]
+            if version == last_version:
+                return last_version
+            population[worst] = self.migrants[source]
+            fitness[worst] = self.migrant_fitness[source]
+        return version
+
+    def work(self, island_id, num_generations, seed):
+        rng = np.random.RandomState(seed + island_id)
+        rows = slice(self.bounds[island_id], self.bounds[island_id + 1])
+        num_survivors = self.num_survivors[island_id]
+        population = self.population[rows].copy()
+        fitness = self.evaluate_function(self.model, population)
+        source = (island_id - 1) % self.num_islands
+        last_version = 0
+        for gen in range(num_generations):
+            population, fitness = Evolution.next_generation(
+                population, fitness, num_survivors, rng=rng)
+            fitness[num_survivors:] = self.evaluate_function(
+                self.model, population[num_survivors:])
+            if (gen + 1) % self.migration_interval == 0:
+                self.emigrate(island_id, population, fitness)
+                last_version = self.immigrate(source, population, fitness,
+                                              last_version)
+            self.history[island_id, gen] = fitness.min()
+            self.generations_done[island_id] = gen + 1
+        self.population[rows] = population
+        self.fitness[rows] = fitness
+
+    def evolve(self, population, num_generations=100, seed=1234):
+        '''Evolves population, split between the islands as evenly as
+        possible, and returns the final population and its fitness. self.history holds
+        the best fitness of every island after each generation.
+        '''
+        self.start(population, num_generations, seed)
+        print('Started {} islands on {} genomes...'.format(
+            self.num_islands, population.shape[0]))
+        while any(worker.is_alive() for worker in self.workers):
+            time.sleep(0.5)
+            gen = int(self.generations_done.min())
+            if gen > 0:
+                print('\rGen: {}/{} | Best Fit: {:G}'.format(
+                      gen, num_generations,
+                      np.nanmin(self.history[:, :gen])), end='')
+        print()
+        for worker in self.workers:
+            worker.join()
+            if worker.exitcode != 0:
+                raise Exception('Island exited with code {}'
+                                .format(worker.exitcode))
+        return self.population.copy(), self.fitness.copy()
@@ -0,0 +1,226 @@
+from OkapiV2.Core import Model, Branch
+import numpy as np
+from OkapiV2.Backend import theano
+import importlib
+import inspect
+import json
+import os
+import types
+
+FORMAT_VERSION = 2
+
+
+def get_path(obj):
+    return '{}.{}'.format(obj.__module__, obj.__qualname__)
+
+
+def resolve(path):
+    module_name, name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), name)
+
+
+def encode(value):
+    if isinstance(value, (types.FunctionType, types.BuiltinFunctionType)):
+        return {'function': get_path(value)}
+    if hasattr(value, 'get_config'):
+        return get_object_spec(value)
+    if isinstance(value, (tuple, list)):
+        return [encode(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def decode(value):
+    if isinstance(value, dict) and 'function' in value:
+        return resolve(value['function'])
+    if isinstance(value, dict) and 'class' in value:
+        return build_object(value)
+    if isinstance(value, list):
+        return tuple(decode(item) for item in value)
+    return value
+
+
+def get_object_spec(obj):
+    '''Returns the class and constructor arguments of a loss, accuracy or
+    regularizer. Raises if get_config misses a constructor argument, which
+    would otherwise be lost silently.
+    '''
+    config = obj.get_config()
+    parameters = inspect.signature(type(obj).__init__).parameters
+    missing = [name for name, parameter in list(parameters.items())[1:]
+               if name not in config and parameter.kind not in
+               (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD)]
+    if missing:
+        raise Exception('Cannot serialize {}, its get_config lacks {}'
+                        .format(type(obj).__name__, ', '.join(missing)))
+    return {'class': get_path(type(obj)),
+            'config': {name: encode(value) for name, value in config.items()}}
+
+
+def build_object(spec):
+    if isinstance(spec, str):
+        return resolve(spec)()
+    config = {name: decode(value) for name, value in spec['config'].items()}
+    return resolve(spec['class'])(**config)
+
+
+def get_branch_spec(branch):
+    inputs = []
+    for input in branch.inputs:
+        if isinstance(input, np.ndarray):
+            inputs.append({'shape': list(input.shape[1:])})
+        else:
+            inputs.append({'branch': get_branch_spec(input)})
+    layers = []
+    for layer in branch.layers:
+        config = {name: encode(value)
+                  for name, value in layer.get_config().items()}
+        layers.append({'class': get_path(type(layer)), 'config': config})
+    return {'merge_mode': branch.merge_mode, 'inputs': inputs,
+            'layers': layers}
+
+
+def build_branch(spec):
+    branch = Branch()
+    branch.merge_mode = spec['merge_mode']
+    for layer_spec in spec['layers']:
+        config = {name: decode(value)
+                  for name, value in layer_spec['config'].items()}
+        branch.add_layer(resolve(layer_spec['class'])(**config))
+    for input_spec in spec['inputs']:
+        if 'branch' in input_spec:
+            branch.add_input(build_branch(input_spec['branch']))
+        else:
+            shape = (0,) + tuple(input_spec['shape'])
+            branch.add_input(np.empty(shape, dtype='float32'))
+    return branch
+
+
+def get_branches(branch):
+    '''Returns the branches in the order of Model.params_shared.'''
+    branches = [branch]
+    for input in branch.inputs:
+        if not isinstance(input, np.ndarray):
+            branches += get_branches(input)
+    return branches
+
+
+def get_spec(model):
+    '''Returns the architecture spec of a model and the list of arrays,
+    parameters then layer state, that make up its flat parameter vector.
+    '''
+    arrays = []
+    params_spec = []
+    for branch_params in model.params_shared:
+        branch_spec = []
+        for layer_params in branch_params:
+            if layer_params is None:
+                branch_spec.append(None)
+                continue
+            values = [params.get_value(borrow=True)
+                      for params in layer_params]
+            branch_spec.append([list(value.shape) for value in values])
+            arrays += values
+        params_spec.append(branch_spec)
+    state_spec = []
+    for branch in get_branches(model.tree):
+        branch_state = []
+        for layer in branch.layers:
+            values = [getattr(layer, name).get_value(borrow=True)
+                      for name in layer.state_names]
+            branch_state.append({name: list(value.shape) for name, value
+                                 in zip(layer.state_names, values)})
+            arrays += values
+        state_spec.append(branch_state)
+    spec = {'format': FORMAT_VERSION,
+            'tree': get_branch_spec(model.tree),
+            'num_output_dims': model.num_output_dims,
+            'loss': get_object_spec(model.loss),
+            'accuracy': get_object_spec(model.accuracy),
+            'outputs': [list(output.shape) for output in model.outputs],
+            'params': params_spec,
+            'state': state_spec}
+    return spec, arrays
+
+
+def save(model, dirname):
+    '''Saves a model as an architecture spec and a flat parameter array.
+
+    model.json describes the Branch tree (layer classes and constructor
+    arguments, merge modes and input shapes), the loss and accuracy with
+    their constructor arguments, the shapes of the outputs and the shapes
+    of the parameters. params.npy holds every parameter followed by
+    the layer state, such as the BatchNorm running statistics, as one
+    float32 vector.
+    '''
+    os.makedirs(dirname, exist_ok=True)
+    spec, arrays = get_spec(model)
+    with open(os.path.join(dirname, 'model.json'), 'w') as file:
+        json.dump(spec, file, indent=1)
+    size = sum(array.size for array in arrays)
+    flat = np.lib.format.open_memmap(os.path.join(dirname, 'params.npy'),
+                                     mode='w+', dtype='float32',
+                                     shape=(size,))
+    index = 0
+    for array in arrays:
+        flat[index:index + array.size] = array.ravel()
+        index += array.size
+    flat.flush()
+    del flat
+
+
+def load_spec(dirname):
+    with open(os.path.join(dirname, 'model.json')) as file:
+        spec = json.load(file)
+    if spec['format'] not in (1, FORMAT_VERSION):
+        raise Exception('Unsupported model format {}'.format(spec['format']))
+    return spec
+
+
+def load(dirname, mmap=True):
+    '''Rebuilds a model saved with save without any training data.
+
+    With mmap the parameters are views of params.npy mapped copy-on-write,
+    so loading costs no copy, pages are read on first use and any writes,
+    e.g. from training or Theano's in-place ops, stay private to the
+    process and never reach the file.
+    '''
+    spec = load_spec(dirname)
+    flat = np.load(os.path.join(dirname, 'params.npy'),
+                   mmap_mode='c' if mmap else None)
+    index = 0
+
+    def take(shape):
+        nonlocal index
+        size = int(np.prod(shape))
+        view = flat[index:index + size].reshape(shape)
+        index += size
+        return theano.shared(view, borrow=True)
+
+    tree = build_branch(spec['tree'])
+    model = Model()
+    model.set_tree(tree)
+    model.set_loss(build_object(spec['loss']))
+    model.set_accuracy(build_object(spec['accuracy']))
+    # Model.predict only reads the shapes of the outputs.
+    for shape in spec.get('outputs', []):
+        model.add_output(np.broadcast_to(np.float32(0), shape))
+    model.num_output_dims = spec['num_output_dims']
+    model.params_shared = []
+    for branch_spec in spec['params']:
+        branch_params = []
+        for layer_spec in branch_spec:
+            if layer_spec is None:
+                branch_params.append(None)
+            else:
+                branch_params.append([take(tuple(shape))
+                                      for shape in layer_spec])
+        model.params_shared.append(branch_params)
+    for branch, branch_state in zip(get_branches(tree), spec['state']):
+        branch.get_output_dim()
+        for layer, shapes in zip(branch.layers, branch_state):
+            for name, shape in shapes.items():
+                setattr(layer, name, take(tuple(shape)))
+    model.prepare(initialize_params=False)
+    return model
@@ -0,0 +1,136 @@
+import numpy as np
+import time
+
+
+class EpochStats():
+    '''Wall-clock timings of one training epoch.
+
+    data_time, step_time and report_time are the seconds spent waiting for
+    batches, running the update step and writing progress. batch_times holds
+    the data plus step latency of every batch.
+    '''
+    def __init__(self, epoch, loss, num_examples, wall_time, data_time,
+                 step_time, report_time, batch_times):
+        self.epoch = epoch
+        self.loss = loss
+        self.num_examples = num_examples
+        self.num_batches = len(batch_times)
+        self.wall_time = wall_time
+        self.data_time = data_time
+        self.step_time = step_time
+        self.report_time = report_time
+        self.batch_times = batch_times
+
+    @property
+    def examples_per_sec(self):
+        return self.num_examples / max(self.wall_time, 1e-12)
+
+    def percentile(self, q):
+        if self.num_batches == 0:
+            return 0.
+        return float(np.percentile(self.batch_times, q))
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p95(self):
+        return self.percentile(95)
+
+    @property
+    def p99(self):
+        return self.percentile(99)
+
+    def as_dict(self):
+        return {'epoch': self.epoch,
+                'loss': self.loss,
+                'num_examples': self.num_examples,
+                'num_batches': self.num_batches,
+                'wall_time': self.wall_time,
+                'data_time': self.data_time,
+                'step_time': self.step_time,
+                'report_time': self.report_time,
+                'examples_per_sec': self.examples_per_sec,
+                'p50': self.p50,
+                'p95': self.p95,
+                'p99': self.p99}
+
+    def __repr__(self):
+        return ('Epoch {} | {:.0f} examples/s | data {:.2f}s | step {:.2f}s '
+                '| report {:.2f}s | p50/p95/p99 {:.1f}/{:.1f}/{:.1f}ms'
+                .format(self.epoch + 1, self.examples_per_sec,
+                        self.data_time, self.step_time, self.report_time,
+                        self.p50 * 1000, self.p95 * 1000, self.p99 * 1000))
+
+
+class Telemetry():
+    '''Records per-batch phase timings with time.perf_counter.
+
+    Call begin_epoch before the first batch is fetched, mark_data once the
+    batch is in hand, mark_step after the update step and mark_report after
+    reporting, or mark_batches for batches run by other processes. end_epoch
+    returns the EpochStats of the finished epoch.
+    '''
+    def __init__(self, num_batches):
+        self.batch_times = np.zeros(num_batches)
+        self.history = []
+
+    def begin_epoch(self, epoch):
+        self.epoch = epoch
+        self.batch_num = 0
+        self.num_examples = 0
+        self.data_time = 0.
+        self.step_time = 0.
+        self.report_time = 0.
+        self.epoch_start = time.perf_counter()
+        self.last_mark = self.epoch_start
+
+    def mark_data(self):
+        now = time.perf_counter()
+        self.batch_data_time = now - self.last_mark
+        self.data_time += self.batch_data_time
+        self.last_mark = now
+
+    def mark_step(self, num_examples):
+        now = time.perf_counter()
+        step_time = now - self.last_mark
+        self.step_time += step_time
+        if self.batch_num == self.batch_times.shape[0]:
+            self.batch_times = np.resize(self.batch_times,
+                                         2 * self.batch_num + 1)
+        self.batch_times[self.batch_num] = self.batch_data_time + step_time
+        self.batch_num += 1
+        self.num_examples += num_examples
+        self.last_mark = now
+
+    def mark_batches(self, num_batches, num_examples):
+        '''Records num_batches batches run elsewhere, e.g. by worker
+        processes, splitting the time since the last mark evenly between
+        them as step time.'''
+        now = time.perf_counter()
+        elapsed = now - self.last_mark
+        stop = self.batch_num + num_batches
+        if stop > self.batch_times.shape[0]:
+            self.batch_times = np.resize(self.batch_times, 2 * stop)
+        self.batch_times[self.batch_num:stop] = elapsed / num_batches
+        self.step_time += elapsed
+        self.batch_num = stop
+        self.num_examples += num_examples
+        self.last_mark = now
+
+    def mark_report(self):
+        now = time.perf_counter()
+        self.report_time += now - self.last_mark
+        self.last_mark = now
+
+    def mean_batch_time(self):
+        return (self.last_mark - self.epoch_start) / max(self.batch_num, 1)
+
+    def end_epoch(self, loss):
+        stats = EpochStats(self.epoch, loss, self.num_examples,
+                           time.perf_counter() - self.epoch_start,
+                           self.data_time, self.step_time, self.report_time,
+                           self.batch_times[:self.batch_num].copy())
+        self.history.append(stats)
+        return stats
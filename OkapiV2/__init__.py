@@ -0,0 +1,22 @@
+'''OkapiV2 neural networks on Theano.
+
+Submodules are imported on first attribute access (PEP 562), and Theano
+itself only once a graph is built, so ``import OkapiV2`` is cheap.
+'''
+import importlib
+
+__all__ = ['Accuracies', 'Activations', 'Backend', 'Callbacks',
+           'Checkpoint', 'Core', 'Datasets', 'Evolution', 'Inference',
+           'Initializers', 'Layers', 'Losses', 'Optimizers', 'Parallel',
+           'Serialization', 'Telemetry']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('OkapiV2.' + name)
+    raise AttributeError("module 'OkapiV2' has no attribute '{}'"
+                         .format(name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
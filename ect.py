@@ -7,7 +7,6 @@ from OkapiV2 import Activations, Datasets, Initializers
 import numpy as np
 import random
 from operator import itemgetter
-from itertools import zip_longest as izip
 
 X_train, y_train, X_val, y_val, X_test, y_test = Datasets.load_mnist()
 
@@ -37,19 +36,21 @@ model.add(ActivationLayer(Activations.alt_softmax))
 
 model.compile(X_train, y_train)
 
-X_batches, y_batches, num_batches = \
-    ok.make_batches(X_train, y_train, batch_size)
+batches = ok.BatchIterator([X_train], y_train, batch_size)
+batches.shuffle_indices()
+num_batches = len(batches)
+
 
 def get_loss(X_batch=None, y_batch=None, full=False):
     if full:
         loss = 0
-        for X_batch, y_batch in izip(X_batches, y_batches):
+        for X_batch, y_batch in batches:
             loss += model.get_train_loss(X_batch, y_batch)
         loss /= num_batches
     else:
         if X_batch is None or y_batch is None:
             ind = random.randrange(0, num_batches)
-            X_batch, y_batch = X_batches[ind], y_batches[ind]
+            X_batch, y_batch = batches.get_batch(ind)
         loss = model.get_train_loss(X_batch, y_batch)
     return loss
 
@@ -62,16 +63,16 @@ params = model.get_params_as_vec()
 for gen in range(num_generations):
     for i in range(params.shape[0]):
         ind = random.randrange(0, num_batches)
-        X_batch, y_batch = X_batches[ind], y_batches[ind]
+        X_batch, y_batch = batches.get_batch(ind)
 
         prev_loss = current_loss
         params[i] += step
-        model.set_params_as_vec(params)
+        model.set_param(i, params[i])
         current_loss = get_loss(X_batch, y_batch)
         while current_loss < prev_loss:
             prev_loss = current_loss
             params[i] += step
-            model.set_params_as_vec(params)
+            model.set_param(i, params[i])
             current_loss = get_loss(X_batch, y_batch)
         print('Param {}/{}: {}'.format(i, params.shape[0], current_loss))
     print('Gen {}/{}: {}'.format(gen + 1, num_generations, current_loss))
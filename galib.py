@@ -1,14 +1,11 @@
-import OkapiV2.Core as ok
-from OkapiV2.Core import Model
+from OkapiV2.Core import Model, Branch
 from OkapiV2.Layers.Basic import FullyConnected, Dropout
 from OkapiV2.Layers.Activations import ActivationLayer, PReLULayer
 from OkapiV2.Layers.Convolutional import Convolutional, MaxPooling
-from OkapiV2 import Activations, Datasets, Initializers
+from OkapiV2.Parallel import PopulationEvaluator
+from OkapiV2 import Activations, Datasets, Evolution, Initializers
 import numpy as np
-import random
-from operator import itemgetter
-
-X_train, y_train, X_val, y_val, X_test, y_test = Datasets.load_mnist()
+import time
 
 dropout_p = 0.2
 num_filters = 32
@@ -16,7 +13,8 @@ filter_size = 3
 pool_size = 2
 num_classes = 10
 pad = True
-batch_size = 10000
+batch_size = 100
+num_workers = 1
 
 population_size = 100
 num_generations = 100
@@ -25,152 +23,85 @@ init_mut_p = 1e-5
 init_mut_std = 1e-3
 init_cross_p = 0.7
 
-model = Model()
-model.add(Convolutional(num_filters, filter_size, filter_size, pad=pad))
-model.add(ActivationLayer(Activations.tanh))
-model.add(MaxPooling(pool_size, pool_size))
-model.add(PReLULayer())
-model.add(Dropout(dropout_p))
-model.add(FullyConnected(bias_initializer=Initializers.glorot_uniform))
-model.add(ActivationLayer(Activations.alt_softmax))
-
-model.compile(X_train, y_train)
-
-X_batches, y_batches, num_batches = \
-    ok.make_batches(X_train, y_train, batch_size)
 
-
-def initialize(population_size):
-    population = []
+def build_model(X_train, y_train):
+    tree = Branch()
+    tree.add_layer(Convolutional(num_filters, filter_size, filter_size,
+                                 pad=pad))
+    tree.add_layer(ActivationLayer(Activations.tanh))
+    tree.add_layer(MaxPooling(pool_size, pool_size))
+    tree.add_layer(PReLULayer())
+    tree.add_layer(Dropout(dropout_p))
+    tree.add_layer(FullyConnected(
+        bias_initializer=Initializers.glorot_uniform))
+    tree.add_layer(ActivationLayer(Activations.alt_softmax))
+    tree.add_input(X_train)
+
+    model = Model()
+    model.set_tree(tree)
+    model.compile([X_train], y_train)
+    return model
+
+
+def initialize(model, population_size):
+    '''Returns population_size random genomes with their rate genes.'''
+    genomes = []
     for i in range(population_size):
-        model.randomize_params(X_train, y_train)
-        individual = {'genome': model.get_params_as_vec()}
-        individual['genome'] = np.append(individual['genome'], [init_mut_std, init_mut_p, init_cross_p])
-        population.append(individual)
-    return population
-
-
-def evaluate(population):
-    for individual in population:
-        model.set_params_as_vec(individual['genome'][:-3])
-        individual['fitness'] = 0
-        for X_batch, y_batch in zip(X_batches, y_batches):
-            individual['fitness'] += model.get_test_loss(X_batch, y_batch)
-        individual['fitness'] /= num_batches
-        print('Fitness: %.4G' % individual['fitness'])
-    return population
-
-
-def remove_lowest(population, proportion=0.5):
-    '''num_left = len(population) - round(proportion * len(population))
-    if num_left % 2 is not 0:
-        num_left += 1
-    population = sorted(
-        population, key=itemgetter('fitness'), reverse=True)[0:num_left]
-    return population'''
-    num_left = len(population) - round(proportion * len(population))
-    if num_left % 2 is not 0:
-        num_left += 1
-    new_population = []
-    while len(new_population) < num_left:
-        new_population.append(selectIndividual(population))
-    return population
-
-
-def selectIndividual(population):
-    '''max = sum([i['genome']for i in population])
-    pick = random.uniform(0, max)
-    current = 0
-    for individual in population:
-        current += individual['genome']
-        if current > pick:
-            return individual'''
-    fits = [i['fitness'] for i in population]
-    probs = 1 - (fits - min(fits)) / (max(fits) - min(fits))
-    print(sum(probs))
-    print(max(probs))
-    print(min(probs))
-    return population[np.random.multinomial(probs)]
-
-
-def crossover(father, mother):
-    if random.random() < 0.5:
-        new_genome = father['genome']
-        cross_genome = mother['genome']
-    else:
-        new_genome = mother['genome']
-        cross_genome = father['genome']
-    cross_p = new_genome[-1]
-    if random.random() < cross_p:
-        cross_point = random.randint(0, new_genome.shape[0])
-        for i in range(cross_point, new_genome.shape[0]):
-            new_genome[i] = cross_genome[i]
-    return new_genome
-
-
-'''def get_families(population, replace=True):
-    num_families = len(population) // 2
-    num_children = (population_size - len(population)) // num_families 
-    last_num_children = (population_size - len(population)) % num_families
-
-    random.shuffle(population)
-    fathers = []
-    mothers = []
-    for i in range(num_families):
-        fathers.append(population.pop())
-        mothers.append(population.pop())
-    if replace:
-        for i in range(num_families):
-            population.append(fathers[i])
-            population.append(mothers[i])
-    return fathers, mothers, num_children, last_num_children, population'''
-
-
-def breed_best(population):
-    '''fathers, mothers, num_children, last_num_children, population = get_families(population)
-
-    for father, mother in zip(fathers, mothers):
-        for child in range(num_children):
-            population.append({'genome': crossover(father, mother)})
-    for child in range(last_num_children):
-        population.append({'genome': crossover(father, mother)})
-    return population'''
-    while len(population) < population_size:
-        father, mother = selectIndividual(population), selectIndividual(population)
-        population.append({'genome': crossover(father, mother)})
-    return population
-
-
-def mutate(population):
-    for individual in population:
-        mut_p = individual['genome'][-2]
-        mut_std = individual['genome'][-3]
-        rand_vals = Initializers.uniform(individual['genome'].shape, mut_std)
-        for i in range(individual['genome'].shape[0]):
-            if random.random() < mut_p:
-                individual['genome'][i] += rand_vals[i]
-    return population
-
-
-print('Starting training...')
-population = initialize(population_size)
-print('Initialized population...')
-evaluate(population)
-for gen in range(num_generations):
-    # population = remove_lowest(population, rm_p)
-    population = breed_best(population)
-    population = mutate(population)
-    population = evaluate(population)
-
-    fits = [i['fitness'] for i in population]
-    best_fitness = min(fits)
-    avg_fitness = sum(fits) / len(fits)
-    mut_ps = [i['genome'][-2] for i in population]
-    mut_stds = [i['genome'][-3] for i in population]
-    cross_ps = [i['genome'][-1] for i in population]
-    avg_mut_p = sum(mut_ps) / len(mut_ps)
-    avg_mut_std = sum(mut_stds) / len(mut_stds)
-    avg_cross_p = sum(cross_ps) / len(cross_ps)
-    print('Gen: %d/%d | Best Fit: %G | Avg Fit: %G | Mut P: %.2E | Mut Std: %.2E | Cross P: %.2E' %
-        (gen + 1, num_generations, best_fitness, avg_fitness, avg_mut_p, avg_mut_std, avg_cross_p))
-
+        model.randomize_params()
+        genomes.append(model.get_params_as_vec())
+    return Evolution.add_rate_genes(np.stack(genomes), init_mut_std,
+                                    init_mut_p, init_cross_p)
+
+
+def get_evaluate(model, X_train, y_train):
+    '''Returns a function giving the test loss of each genome.'''
+    if num_workers > 1:
+        evaluator = PopulationEvaluator(model, [X_train], y_train,
+                                        num_workers)
+        return evaluator.evaluate
+
+    def evaluate(genomes):
+        return model.get_population_loss(
+            genomes[:, :-Evolution.NUM_RATE_GENES], [X_train], y_train,
+            batch_size)
+    return evaluate
+
+
+def evolve(population, fitness, evaluate, num_survivors):
+    '''Advances the population one generation, evaluating only the new
+    children.'''
+    population, fitness = Evolution.next_generation(
+        population, fitness, num_survivors)
+    fitness[num_survivors:] = evaluate(population[num_survivors:])
+    return population, fitness
+
+
+def write_generation(gen, num_generations, population, fitness, gen_time):
+    print('Gen: %d/%d | Best Fit: %G | Avg Fit: %G | Mut P: %.2E | '
+          'Mut Std: %.2E | Cross P: %.2E | Time: %.1fs' %
+          (gen + 1, num_generations, fitness.min(), fitness.mean(),
+           population[:, Evolution.MUT_P].mean(),
+           population[:, Evolution.MUT_STD].mean(),
+           population[:, Evolution.CROSS_P].mean(), gen_time))
+
+
+def main():
+    X_train, y_train, X_val, y_val, X_test, y_test = Datasets.load_mnist()
+    model = build_model(X_train, y_train)
+    evaluate = get_evaluate(model, X_train, y_train)
+    num_survivors = population_size - int(round(rm_p * population_size))
+
+    print('Starting training...')
+    population = initialize(model, population_size)
+    fitness = evaluate(population)
+    print('Initialized population...')
+    for gen in range(num_generations):
+        start = time.perf_counter()
+        population, fitness = evolve(population, fitness, evaluate,
+                                     num_survivors)
+        write_generation(gen, num_generations, population, fitness,
+                         time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+from OkapiV2.Parallel import IslandGA
+from OkapiV2 import Datasets
+import galib
+import numpy as np
+import time
+
+num_islands = 4
+migration_interval = 5
+num_migrants = 2
+num_generations = 100
+
+
+def run_single(model, population, X_train, y_train):
+    '''Runs galib's single-population loop and returns the best fitness
+    after each generation.'''
+    evaluate = galib.get_evaluate(model, X_train, y_train)
+    num_survivors = population.shape[0] - \
+        int(round(galib.rm_p * population.shape[0]))
+    fitness = evaluate(population)
+    history = []
+    for gen in range(num_generations):
+        population, fitness = galib.evolve(population, fitness, evaluate,
+                                           num_survivors)
+        history.append(fitness.min())
+    return np.array(history)
+
+
+def compare(model, population, X_train, y_train):
+    '''Evolves copies of population as one population and as islands and
+    prints both runs' time and best fitness every migration_interval
+    generations. Returns the two best-fitness histories.'''
+    start = time.perf_counter()
+    single_history = run_single(model, population.copy(), X_train, y_train)
+    single_time = time.perf_counter() - start
+
+    islands = IslandGA(model, [X_train], y_train, num_islands,
+                       migration_interval, num_migrants, galib.rm_p,
+                       galib.batch_size)
+    start = time.perf_counter()
+    islands.evolve(population.copy(), num_generations)
+    island_time = time.perf_counter() - start
+    island_history = islands.history.min(axis=0)
+
+    print('Single population: {:.1f}s | {} islands: {:.1f}s | '
+          'Speedup: {:.2f}x'.format(single_time, num_islands, island_time,
+                                    single_time / island_time))
+    for gen in range(migration_interval - 1, num_generations,
+                     migration_interval):
+        print('Gen: {}/{} | Single Best Fit: {:G} | Islands Best Fit: {:G}'
+              .format(gen + 1, num_generations, single_history[gen],
+                      island_history[gen]))
+    return single_history, island_history
+
+
+def main():
+    X_train, y_train, X_val, y_val, X_test, y_test = Datasets.load_mnist()
+    model = galib.build_model(X_train, y_train)
+    population = galib.initialize(model, galib.population_size)
+    compare(model, population, X_train, y_train)
+
+
+if __name__ == '__main__':
+    main()
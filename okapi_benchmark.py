@@ -0,0 +1,380 @@
+import subprocess
+import sys
+import time
+
+batch_size = 128
+num_filters = 32
+filter_size = 3
+pool_size = 2
+pad = True
+
+
+def build_mlp(x_train):
+    from OkapiV2.Core import Model, Branch
+    from OkapiV2.Layers.Basic import FullyConnected
+    from OkapiV2.Layers.Activations import ActivationLayer, PReLULayer
+    from OkapiV2 import Activations
+
+    tree = Branch()
+    tree.add_layer(FullyConnected((512, 1, 1, 1)))
+    tree.add_layer(PReLULayer())
+    tree.add_layer(FullyConnected((512, 1, 1, 1)))
+    tree.add_layer(PReLULayer())
+    tree.add_layer(FullyConnected())
+    tree.add_layer(ActivationLayer(Activations.softmax))
+    tree.add_input(x_train)
+
+    model = Model()
+    model.set_tree(tree)
+    return model
+
+
+def build_convnet(x_train):
+    from OkapiV2.Core import Model, Branch
+    from OkapiV2.Layers.Basic import FullyConnected
+    from OkapiV2.Layers.Activations import ActivationLayer, PReLULayer
+    from OkapiV2.Layers.Convolutional import Convolutional, MaxPooling
+    from OkapiV2 import Activations
+
+    tree = Branch()
+    tree.add_layer(Convolutional(num_filters, filter_size, filter_size,
+                                 pad=pad))
+    tree.add_layer(PReLULayer())
+    tree.add_layer(MaxPooling(pool_size, pool_size))
+    tree.add_layer(Convolutional(num_filters, filter_size, filter_size,
+                                 pad=pad))
+    tree.add_layer(PReLULayer())
+    tree.add_layer(MaxPooling(pool_size, pool_size))
+    tree.add_layer(FullyConnected())
+    tree.add_layer(ActivationLayer(Activations.softmax))
+    tree.add_input(x_train)
+
+    model = Model()
+    model.set_tree(tree)
+    return model
+
+
+def load_synthetic(shape, num_examples, num_classes=10, seed=0):
+    '''Centered uniform inputs of the given shape, labelled by a random
+    linear map so that they can be learned. Lets the benchmarks run
+    offline.
+    '''
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    x = rng.rand(num_examples, *shape).astype('float32') - 0.5
+    weights = rng.randn(int(np.prod(shape)), num_classes).astype('float32')
+    labels = x.reshape(num_examples, -1).dot(weights).argmax(axis=1)
+    return x, np.eye(num_classes, dtype='float32')[labels]
+
+
+def load(dataset):
+    '''Returns the training set of dataset and its benchmark model. The
+    synthetic_mnist and synthetic_cifar10 datasets have the same shapes as
+    the real training sets.
+    '''
+    from OkapiV2 import Datasets
+    if dataset == 'synthetic_mnist':
+        x_train, y_train = load_synthetic((1, 28, 28), 50000)
+        return x_train, y_train, build_mlp(x_train)
+    if dataset == 'synthetic_cifar10':
+        x_train, y_train = load_synthetic((3, 32, 32), 45000)
+        return x_train, y_train, build_convnet(x_train)
+    if dataset == 'cifar10':
+        x_train, y_train, x_val, y_val, x_test, y_test = \
+            Datasets.load_cifar10()
+        return x_train, y_train, build_convnet(x_train)
+    x_train, y_train, x_val, y_val, x_test, y_test = Datasets.load_mnist()
+    return x_train, y_train, build_mlp(x_train)
+
+
+def time_epoch(model, x_train, y_train, batch_size=batch_size, **kwargs):
+    model.get_function('update_step', False)
+    start = time.perf_counter()
+    model.train([x_train], y_train, num_epochs=1, batch_size=batch_size,
+                **kwargs)
+    return time.perf_counter() - start
+
+
+def benchmark_prefetch(dataset='mnist', depths=(0, 1, 2, 4)):
+    from OkapiV2.Core import BatchIterator
+    x_train, y_train, model = load(dataset)
+    model.compile([x_train], y_train)
+
+    start = time.perf_counter()
+    for x_batch, y_batch in BatchIterator([x_train], y_train, batch_size):
+        pass
+    prep_time = time.perf_counter() - start
+
+    results = []
+    for depth in depths:
+        epoch_time = time_epoch(model, x_train, y_train, prefetch=depth)
+        results.append((depth, epoch_time))
+
+    base_time = results[0][1]
+    print('\n{} | batch prep: {:.2f}s/epoch'.format(dataset, prep_time))
+    for depth, epoch_time in results:
+        hidden = (base_time - epoch_time) / prep_time * 100
+        print('Prefetch {} | Epoch: {:.2f}s | {:.0f} examples/s | '
+              'Prep hidden: {:.0f}%'
+              .format(depth, epoch_time, y_train.shape[0] / epoch_time,
+                      hidden))
+    return results
+
+
+def benchmark_cold_start(dataset='mnist'):
+    x_train, y_train, model = load(dataset)
+    start = time.perf_counter()
+    model.compile([x_train], y_train)
+    model.predict_theano(x_train[:1].astype('float32'))
+    cold_start = time.perf_counter() - start
+    print('{} | Time to first prediction: {:.2f}s | Functions built: {}'
+          .format(dataset, cold_start, len(model.functions)))
+    return cold_start
+
+
+def benchmark_data_parallel(dataset='mnist', batch_size=1024,
+                            worker_counts=(1, 2, 4, 8, 16)):
+    from OkapiV2.Parallel import DataParallelTrainer
+    x_train, y_train, model = load(dataset)
+    model.compile([x_train], y_train)
+    model.get_function('grad_vec')
+    model.get_function('apply_grad_vec')
+    train_time = time_epoch(model, x_train, y_train, int(batch_size))
+    results = []
+    for num_workers in worker_counts:
+        trainer = DataParallelTrainer(model, int(num_workers))
+        start = time.perf_counter()
+        trainer.train([x_train], y_train, num_epochs=1,
+                      batch_size=int(batch_size))
+        epoch_time = time.perf_counter() - start
+        results.append((num_workers, epoch_time))
+
+    base_time = results[0][1]
+    print('\n{} | batch size: {} | Model.train: {:.2f}s | '
+          '{:.0f} examples/s'.format(dataset, batch_size, train_time,
+                                     y_train.shape[0] / train_time))
+    for num_workers, epoch_time in results:
+        print('Workers {} | Epoch: {:.2f}s | {:.0f} examples/s | '
+              'Speedup: {:.2f}x'
+              .format(num_workers, epoch_time, y_train.shape[0] / epoch_time,
+                      base_time / epoch_time))
+    return results
+
+
+def benchmark_hogwild(dataset='mnist', worker_counts=(1, 2, 4, 8, 16)):
+    '''Compares one epoch of Model.train with Hogwild on 1 to 16 workers,
+    every run starting from the same params.'''
+    from OkapiV2.Parallel import HogwildTrainer
+    x_train, y_train, model = load(dataset)
+    model.compile([x_train], y_train)
+    model.get_function('grad_vec')
+    init_params = model.get_params_as_vec()
+    base_time = time_epoch(model, x_train, y_train)
+    accuracy = model.get_accuracy([x_train], y_train)
+    print('\n{} | Model.train: {:.2f}s | {:.0f} examples/s | '
+          'Train accuracy: {:.2f}%'
+          .format(dataset, base_time, y_train.shape[0] / base_time,
+                  accuracy))
+    results = [(0, base_time, accuracy)]
+    for num_workers in worker_counts:
+        model.set_params_as_vec(init_params)
+        start = time.perf_counter()
+        HogwildTrainer(model, int(num_workers)).train(
+            [x_train], y_train, num_epochs=1, batch_size=batch_size)
+        epoch_time = time.perf_counter() - start
+        accuracy = model.get_accuracy([x_train], y_train)
+        results.append((num_workers, epoch_time, accuracy))
+        print('Hogwild {} | Epoch: {:.2f}s | {:.0f} examples/s | '
+              'Speedup: {:.2f}x | Train accuracy: {:.2f}%'
+              .format(num_workers, epoch_time, y_train.shape[0] / epoch_time,
+                      base_time / epoch_time, accuracy))
+    return results
+
+
+def benchmark_profile(dataset='mnist', n_batches=10):
+    x_train, y_train, model = load(dataset)
+    model.compile([x_train], y_train)
+    return model.profile([x_train], y_train, n_batches=int(n_batches),
+                         batch_size=batch_size)
+
+
+def benchmark_serving(dataset='mnist', dirname='okapi_serving_model'):
+    from OkapiV2 import Serialization, Inference
+    x_train, y_train, model = load(dataset)
+    model.compile([x_train], y_train)
+    Serialization.save(model, dirname)
+    x_batch = x_train[:128]
+
+    start = time.perf_counter()
+    engine = Inference.load(dirname)
+    numpy_preds = engine.predict([x_batch])[0]
+    numpy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    theano_model = Serialization.load(dirname)
+    theano_preds = theano_model.predict([x_batch])[0]
+    theano_time = time.perf_counter() - start
+
+    print('{} | First prediction: NumPy engine {:.3f}s | Theano {:.3f}s | '
+          'Max difference: {:.2e}'
+          .format(dataset, numpy_time, theano_time,
+                  abs(numpy_preds - theano_preds).max()))
+    return numpy_time, theano_time
+
+
+def benchmark_population(dataset='mnist', population_size=20,
+                         num_examples=2000):
+    '''Times evaluating a population of random genomes one at a time with
+    set_params_as_vec and get_test_loss against get_population_loss.
+    '''
+    import numpy as np
+    population_size = int(population_size)
+    num_examples = int(num_examples)
+    x_train, y_train, model = load(dataset)
+    x_train, y_train = x_train[:num_examples], y_train[:num_examples]
+    model.compile([x_train], y_train)
+    genomes = []
+    for i in range(population_size):
+        model.randomize_params()
+        genomes.append(model.get_params_as_vec())
+    genomes = np.stack(genomes)
+    model.get_population_loss(genomes, [x_train[:1]], y_train[:1],
+                              batch_size)
+    model.get_test_loss([x_train[:1]], y_train[:1])
+
+    start = time.perf_counter()
+    loop_losses = []
+    for genome in genomes:
+        model.set_params_as_vec(genome)
+        loss = 0
+        for start_i in range(0, num_examples, batch_size):
+            x_batch = x_train[start_i:start_i + batch_size]
+            loss += model.get_test_loss([x_batch],
+                                        y_train[start_i:start_i +
+                                                batch_size]) * \
+                x_batch.shape[0]
+        loop_losses.append(loss / num_examples)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    population_losses = model.get_population_loss(
+        genomes, [x_train], y_train, batch_size)
+    population_time = time.perf_counter() - start
+
+    print('{} | Population of {} | Loop {:.3f}s | Batched {:.3f}s | '
+          'Speedup {:.1f}x | Max difference: {:.2e}'
+          .format(dataset, population_size, loop_time, population_time,
+                  loop_time / population_time,
+                  abs(np.array(loop_losses) - population_losses).max()))
+    return loop_time, population_time
+
+
+def benchmark_population_evaluator(dataset='mnist', population_size=32,
+                                   num_examples=2000,
+                                   worker_counts=(1, 2, 4, 8)):
+    import numpy as np
+    from OkapiV2.Parallel import PopulationEvaluator
+    x_train, y_train, model = load(dataset)
+    x_train = x_train[:int(num_examples)]
+    y_train = y_train[:int(num_examples)]
+    model.compile([x_train], y_train)
+    genomes = []
+    for i in range(int(population_size)):
+        model.randomize_params()
+        genomes.append(model.get_params_as_vec())
+    genomes = np.stack(genomes)
+    results = []
+    for num_workers in worker_counts:
+        evaluator = PopulationEvaluator(model, [x_train], y_train,
+                                        int(num_workers))
+        evaluator.evaluate(genomes[:1])
+        start = time.perf_counter()
+        evaluator.evaluate(genomes)
+        results.append((num_workers, time.perf_counter() - start))
+        evaluator.stop()
+
+    base_time = results[0][1]
+    print('\n{} | Population of {} on {} examples'
+          .format(dataset, population_size, num_examples))
+    for num_workers, eval_time in results:
+        print('Workers {} | Generation: {:.2f}s | Speedup: {:.2f}x'
+              .format(num_workers, eval_time, base_time / eval_time))
+    return results
+
+
+def benchmark_es(dataset='mnist', num_steps=10, num_pairs=50,
+                 worker_counts=(1, 2, 4, 8, 16)):
+    import numpy as np
+    from OkapiV2.Parallel import ESTrainer, NoiseTable
+    x_train, y_train, model = load(dataset)
+    model.compile([x_train], y_train)
+    noise_table = NoiseTable()
+    indices = np.arange(batch_size, dtype='int32')
+    results = []
+    for num_workers in worker_counts:
+        trainer = ESTrainer(model, int(num_workers), int(num_pairs),
+                            noise_table=noise_table)
+        trainer.start([x_train], y_train, batch_size)
+        trainer.step(indices)
+        start = time.perf_counter()
+        for i in range(int(num_steps)):
+            loss = trainer.step(indices)
+        step_time = (time.perf_counter() - start) / int(num_steps)
+        trainer.stop()
+        results.append((num_workers, step_time, loss))
+
+    base_time = results[0][1]
+    print('\n{} | {} antithetic pairs per step'.format(dataset, num_pairs))
+    for num_workers, step_time, loss in results:
+        print('Workers {} | Step: {:.3f}s | {:.0f} evaluations/s | '
+              'Speedup: {:.2f}x | Loss: {:.4f}'
+              .format(num_workers, step_time,
+                      2 * int(num_pairs) / step_time,
+                      base_time / step_time, loss))
+    return results
+
+
+def benchmark_import_time(module='OkapiV2.Core', budget_ms=None, top=10):
+    '''Measures the cold import time of module with python -X importtime.
+
+    Prints the slowest imports and whether Theano was pulled in. With
+    budget_ms the benchmark fails when the import exceeds it, so it can be
+    tracked as a regression target.
+    '''
+    code = 'import sys, {}; print("theano" in sys.modules)'.format(module)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+    total_ms = max(imports)[0] / 1000
+    print('import {} | {:.1f}ms | theano loaded: {}'
+          .format(module, total_ms, result.stdout.strip()))
+    for cumulative_us, self_us, name in sorted(imports, reverse=True)[:top]:
+        print('{:>10.1f}ms {:>10.1f}ms {}'.format(cumulative_us / 1000,
+                                                 self_us / 1000, name))
+    if budget_ms is not None and total_ms > float(budget_ms):
+        raise SystemExit('import {} took {:.1f}ms, over the {}ms budget'
+                         .format(module, total_ms, budget_ms))
+    return total_ms
+
+
+if __name__ == '__main__':
+    benchmarks = {
+        'prefetch': benchmark_prefetch,
+        'cold_start': benchmark_cold_start,
+        'data_parallel': benchmark_data_parallel,
+        'hogwild': benchmark_hogwild,
+        'profile': benchmark_profile,
+        'serving': benchmark_serving,
+        'population': benchmark_population,
+        'population_evaluator': benchmark_population_evaluator,
+        'es': benchmark_es,
+        'import_time': benchmark_import_time,
+    }
+    name = sys.argv[1] if len(sys.argv) > 1 else 'prefetch'
+    benchmarks[name](*sys.argv[2:])
@@ -143,13 +143,13 @@ def main_keras():
     print('Test accuracy:', keras_accuracy)
     return keras_accuracy
 
-okapi_start = time.clock()
+okapi_start = time.perf_counter()
 okapi_accuracy = round(main_okapi(), 2)
-okapi_time = round(time.clock() - okapi_start, 2)
+okapi_time = round(time.perf_counter() - okapi_start, 2)
 
-keras_start = time.clock()
+keras_start = time.perf_counter()
 keras_accuracy = round(main_keras() * 100, 2)
-keras_time = round(time.clock() - keras_start, 2)
+keras_time = round(time.perf_counter() - keras_start, 2)
 
 print('Okapi Accuracy: {}, Time: {} \nKeras Accuracy: {}, Time: {}'
       .format(okapi_accuracy, okapi_time, keras_accuracy, keras_time))
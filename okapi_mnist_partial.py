@@ -21,7 +21,7 @@ model.set_tree(tree)
 model.set_optimizer(Optimizers.RMSprop(learning_rate=0.00005))
 
 index = 60000
-model.train([x_train[:index, :, :, :]], y_train[:index, :], 24)
+model.train([x_train[:index, :, :, :]], y_train[:index, :], 24, resident=True)
 accuracy = model.get_accuracy([x_train[:index, :, :, :]], y_train[:index])
 print('Accuracy: {}%'.format(accuracy))
 test_accuracy = model.get_accuracy([x_test], y_test)
@@ -195,13 +195,13 @@ def main_keras():
                 sys.stdout.flush()
             print()
 
-okapi_start = time.clock()
+okapi_start = time.perf_counter()
 main_okapi()
-okapi_time = round(time.clock() - okapi_start, 2)
+okapi_time = round(time.perf_counter() - okapi_start, 2)
 
-'''keras_start = time.clock()
+'''keras_start = time.perf_counter()
 main_keras()
-keras_time = round(time.clock() - keras_start, 2)
+keras_time = round(time.perf_counter() - keras_start, 2)
 
 print('Okapi Time: {} \nKeras Time: {}'
       .format(okapi_time, keras_time))'''
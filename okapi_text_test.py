@@ -61,7 +61,7 @@ rmsprop_momentum = 0.9
 num_epochs = 5
 
 
-start_time_1 = time.clock()
+start_time_1 = time.perf_counter()
 model = Model()
 model.add(GRULayer((h_layer_size, 1, 1, 1), return_sequences=False))
 model.add(BatchNormalizationLayer())
@@ -116,7 +116,7 @@ def predict():
 
 model.train(X_train, y_train, num_epochs=num_epochs,
             epoch_callback=predict)
-end_time_1 = time.clock()
+end_time_1 = time.perf_counter()
 t1 = end_time_1 - start_time_1
 
 ok.save_model(model)
@@ -126,7 +126,7 @@ model = ok.load_model()
 model.reinforce(X_train, y_train, num_epochs=num_epochs,
                 epoch_callback=predict)
 
-'''start_time_2 = time.clock()
+'''start_time_2 = time.perf_counter()
 model_keras = Sequential()
 model_keras.add(GRU(h_layer_size, input_dim=len(chars),
                 init='normal', return_sequences=False))
@@ -147,7 +147,7 @@ sgd = k_RMSprop(lr=learning_rate, rho=rmsprop_momentum)
 
 model_keras.compile(loss='categorical_crossentropy', optimizer=sgd)
 model_keras.fit(X_train, y_train, batch_size=batch_size, nb_epoch=num_epochs)
-end_time_2 = time.clock()
+end_time_2 = time.perf_counter()
 t2 = end_time_2 - start_time_2
 
 print("Okapi took {} seconds, and Keras took {} seconds".format(t1, t2))
@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pytest
+from OkapiV2.Core import Model, Branch
+from OkapiV2.Layers.Basic import FullyConnected
+from OkapiV2.Layers.Activations import ActivationLayer
+from OkapiV2 import Activations, Checkpoint
+
+
+def make_model():
+    x = np.random.RandomState(0).rand(8, 5).astype('float32')
+    y = np.eye(2, dtype='float32')[np.arange(8) % 2]
+    tree = Branch()
+    tree.add_layer(FullyConnected())
+    tree.add_layer(ActivationLayer(Activations.softmax))
+    tree.add_input(x)
+    model = Model()
+    model.set_tree(tree)
+    model.compile([x], y)
+    return model
+
+
+def test_resumed_writer_continues_numbering(tmp_path):
+    model = make_model()
+    dirname = str(tmp_path)
+    writer = Checkpoint.CheckpointWriter(model, dirname, keep=3)
+    for i in range(2):
+        writer.save(i)
+    writer.close()
+
+    resumed = Checkpoint.CheckpointWriter(model, dirname, keep=3)
+    assert resumed.save(2).endswith('checkpoint_000002.npz')
+    resumed.save(3)
+    resumed.close()
+    assert sorted(os.listdir(dirname)) == [
+        'checkpoint_000001.npz', 'checkpoint_000002.npz',
+        'checkpoint_000003.npz']
+    assert Checkpoint.load_checkpoint(model, resumed.latest()) == (3, 0)
+
+
+def test_write_syncs_before_rename(tmp_path, monkeypatch):
+    calls = []
+    fsync, replace = os.fsync, os.replace
+    monkeypatch.setattr(os, 'fsync',
+                        lambda fd: calls.append('fsync') or fsync(fd))
+    monkeypatch.setattr(os, 'replace',
+                        lambda *args: calls.append('replace') or
+                        replace(*args))
+    writer = Checkpoint.CheckpointWriter(make_model(), str(tmp_path))
+    writer.save()
+    writer.close()
+    assert calls[:2] == ['fsync', 'replace']
+
+
+def test_failed_write_removes_temporary_file(tmp_path, monkeypatch):
+    def failing_savez(file, **arrays):
+        file.write(b'partial')
+        raise IOError('disk full')
+    monkeypatch.setattr(np, 'savez', failing_savez)
+    writer = Checkpoint.CheckpointWriter(make_model(), str(tmp_path))
+    writer.save()
+    with pytest.raises(IOError):
+        writer.close()
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from OkapiV2.Core import (Model, Branch, atleast_4d, expand_4d,
+                          save_model, load_model)
+from OkapiV2.Layers.Basic import FullyConnected, BatchNorm, Dropout
+from OkapiV2.Layers.Activations import ActivationLayer
+from OkapiV2 import Activations, Optimizers
+
+
+def make_data(num_examples=64, num_features=8, num_classes=3, seed=0):
+    rng = np.random.RandomState(seed)
+    x = rng.rand(num_examples, num_features).astype('float32')
+    labels = rng.randint(0, num_classes, num_examples)
+    y = np.eye(num_classes, dtype='float32')[labels]
+    return x, y
+
+
+def dense_model(x, y):
+    np.random.seed(2)
+    tree = Branch()
+    tree.add_layer(FullyConnected((6, 1, 1, 1)))
+    tree.add_layer(ActivationLayer(Activations.tanh))
+    tree.add_layer(FullyConnected())
+    tree.add_layer(ActivationLayer(Activations.softmax))
+    tree.add_input(x)
+    model = Model()
+    model.set_tree(tree)
+    model.set_optimizer(Optimizers.SGD(learning_rate=0.1))
+    model.compile([x], y)
+    return model
+
+
+def batch_norm_model(x, y):
+    tree = Branch()
+    tree.add_layer(FullyConnected((6, 1, 1, 1)))
+    tree.add_layer(BatchNorm())
+    tree.add_layer(FullyConnected())
+    tree.add_layer(ActivationLayer(Activations.softmax))
+    tree.add_input(x)
+    model = Model()
+    model.set_tree(tree)
+    model.compile([x], y)
+    return model, tree.layers[1]
+
+
+def test_update_step_updates_batch_norm_running_stats():
+    x, y = make_data()
+    model, batch_norm = batch_norm_model(x, y)
+    update_step = model.get_function('update_step', False)
+    updated = [input.variable for input in update_step.maker.inputs
+               if input.update is not None]
+    assert any(variable is batch_norm.running_mean for variable in updated)
+    assert any(variable is batch_norm.running_std for variable in updated)
+
+    running_mean = batch_norm.running_mean.get_value().copy()
+    update_step(atleast_4d(expand_4d(x)), atleast_4d(expand_4d(y)))
+    assert not np.allclose(batch_norm.running_mean.get_value(), running_mean)
+
+
+def test_params_buffer_survives_save_and_load(tmp_path):
+    x, y = make_data()
+    model, batch_norm = batch_norm_model(x, y)
+    model.get_test_loss([x], y)
+    filename = str(tmp_path / 'model.pk')
+    save_model(model, filename)
+    loaded = load_model(filename)
+
+    params = np.random.RandomState(1).rand(
+        loaded.get_params_as_vec().shape[0]).astype('float32')
+    loaded.set_params_as_vec(params)
+    values = [shared.get_value().ravel() for shared in loaded.get_all_params()]
+    np.testing.assert_array_equal(np.concatenate(values), params)
+    np.testing.assert_array_equal(loaded.get_params_as_vec(), params)
+    model.set_params_as_vec(params)
+    np.testing.assert_allclose(loaded.get_test_loss([x], y),
+                               model.get_test_loss([x], y), rtol=1e-5)
+
+
+def test_accumulated_steps_match_full_batches():
+    x, y = make_data(num_examples=72)
+    full = dense_model(x, y)
+    accumulated = dense_model(x, y)
+    full.train([x], y, num_epochs=2, batch_size=32, shuffle=False,
+               verbose=False)
+    accumulated.train([x], y, num_epochs=2, batch_size=32, shuffle=False,
+                      accumulate_steps=4, verbose=False)
+    np.testing.assert_allclose(accumulated.get_params_as_vec(),
+                               full.get_params_as_vec(), atol=1e-5)
+
+
+def test_accumulate_steps_must_divide_batch_size():
+    x, y = make_data()
+    model = dense_model(x, y)
+    with pytest.raises(ValueError):
+        model.train([x], y, batch_size=30, accumulate_steps=4,
+                    verbose=False)
+
+
+def test_building_graphs_does_not_rename_inputs():
+    x, y = make_data()
+    tree = Branch()
+    tree.add_layer(Dropout(0.8))
+    tree.add_layer(FullyConnected())
+    tree.add_layer(ActivationLayer(Activations.softmax))
+    tree.add_input(x)
+    model = Model()
+    model.set_tree(tree)
+    model.compile([x], y)
+    names = [data_input.name for data_input in model.data_inputs]
+    model.predict([x])
+    model.profile([x], y, n_batches=1, batch_size=32, repeats=1)
+    assert [data_input.name for data_input in model.data_inputs] == names
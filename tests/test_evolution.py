@@ -0,0 +1,24 @@
+import numpy as np
+from OkapiV2 import Evolution, Initializers
+
+
+def test_mutation_noise_matches_initializers_uniform():
+    mut_std = 0.3
+    population = np.zeros((200, 500))
+    Evolution.mutate(population, 1., mut_std,
+                     rng=np.random.RandomState(0))
+    np.random.seed(0)
+    reference = Initializers.uniform(population.shape, mut_std)
+    bound = np.sqrt(3) * mut_std
+    for noise in (population, reference):
+        assert np.abs(noise).max() <= bound
+        assert abs(noise.std() - mut_std) < 0.01 * mut_std
+        assert abs(np.abs(noise).max() - bound) < 0.01 * bound
+
+
+def test_mutation_respects_per_genome_probability():
+    population = np.zeros((2, 10000))
+    Evolution.mutate(population, np.array([0., 0.5]), 1.,
+                     rng=np.random.RandomState(0))
+    assert not population[0].any()
+    assert abs((population[1] != 0).mean() - 0.5) < 0.02
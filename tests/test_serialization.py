@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from OkapiV2.Core import Model, Branch
+from OkapiV2.Layers.Basic import FullyConnected
+from OkapiV2.Layers.Activations import ActivationLayer
+from OkapiV2 import Accuracies, Activations, Inference, Losses, Serialization
+
+
+def make_model(x, y, loss, accuracy):
+    tree = Branch()
+    tree.add_layer(FullyConnected())
+    tree.add_layer(ActivationLayer(Activations.softmax))
+    tree.add_input(x)
+    model = Model()
+    model.set_tree(tree)
+    model.set_loss(loss)
+    model.set_accuracy(accuracy)
+    return model
+
+
+def test_round_trip_keeps_loss_arguments_and_outputs(tmp_path):
+    rng = np.random.RandomState(0)
+    x = rng.rand(16, 5).astype('float32')
+    y = np.eye(4, dtype='float32')[rng.randint(0, 4, 16)]
+    model = make_model(x, y, Losses.MeanSquared(Losses.L2Reg(0.25)),
+                       Accuracies.TopK(2))
+    model.add_output(y[:, :2])
+    model.add_output(y[:, 2:])
+    model.compile([x], y)
+    dirname = str(tmp_path / 'model')
+    Serialization.save(model, dirname)
+    loaded = Serialization.load(dirname)
+
+    assert type(loaded.loss) is Losses.MeanSquared
+    assert type(loaded.loss.regularizer) is Losses.L2Reg
+    assert loaded.loss.regularizer.param == 0.25
+    assert type(loaded.accuracy) is Accuracies.TopK
+    assert loaded.accuracy.k == 2
+    assert [output.shape for output in loaded.outputs] == \
+        [output.shape for output in model.outputs]
+    expected = model.predict([x])
+    for preds in (loaded.predict([x]), Inference.load(dirname).predict([x])):
+        assert len(preds) == len(expected)
+        for pred, expected_pred in zip(preds, expected):
+            np.testing.assert_allclose(pred, expected_pred, rtol=1e-5)
+
+
+class ScaledCrossentropy(Losses.Crossentropy):
+    def __init__(self, scale):
+        super().__init__()
+        self.scale = scale
+
+
+def test_save_raises_when_loss_arguments_are_not_in_its_config(tmp_path):
+    x = np.zeros((4, 5), dtype='float32')
+    y = np.eye(4, dtype='float32')
+    model = make_model(x, y, ScaledCrossentropy(2.), Accuracies.Categorical())
+    model.compile([x], y)
+    with pytest.raises(Exception, match='scale'):
+        Serialization.save(model, str(tmp_path / 'model'))